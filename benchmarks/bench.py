@@ -0,0 +1,285 @@
+# 
+# Copyright (c) 2011-2014, Thomas Bischof
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without 
+# modification, are permitted provided that the following conditions are met:
+# 
+# 1. Redistributions of source code must retain the above copyright notice, 
+#    this list of conditions and the following disclaimer.
+# 
+# 2. Redistributions in binary form must reproduce the above copyright notice, 
+#    this list of conditions and the following disclaimer in the documentation 
+#    and/or other materials provided with the distribution.
+# 
+# 3. Neither the name of the Massachusetts Institute of Technology nor the 
+#    names of its contributors may be used to endorse or promote products 
+#    derived from this software without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" 
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE 
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE 
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE 
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR 
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF 
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS 
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN 
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) 
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE 
+# POSSIBILITY OF SUCH DAMAGE.
+# 
+
+
+"""
+Benchmarks of the readers and writers on synthetic files. Run from the top of
+the source tree:
+
+    python -m benchmarks.bench --frames 1000 --output results.json
+
+Each scenario is run --repeat times and the best time is kept. Results are
+written as JSON, one record per scenario with its throughput in MB/s and
+files/s, along with the package version and platform, so they can be
+compared across releases.
+"""
+
+import argparse
+import io
+import json
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy
+
+import winspec
+from winspec import cstruct
+from winspec.Winspec import winspec_v2_4_header_t, write_winspec
+
+from . import synthetic
+
+SCENARIOS = list()
+
+def scenario(function):
+    SCENARIOS.append(function)
+    return(function)
+
+@scenario
+def header_parse(context):
+    """
+    Decode the 4100-byte header of every version 2.x file.
+    """
+    n_bytes = 0
+    for path in context["winspec_files"]:
+        with open(path, "rb") as data_file:
+            header = cstruct.CStruct(winspec_v2_4_header_t)
+            header.from_stream(data_file)
+        n_bytes += header.size()
+    return(n_bytes, len(context["winspec_files"]))
+
+@scenario
+def winspec_full_read(context):
+    """
+    Read every frame of a version 2.x file as one array.
+    """
+    with winspec.Winspec(context["winspec"], cache=False) as reader:
+        data = reader.data()
+    return(data.nbytes, 1)
+
+@scenario
+def winspec_random_frames(context):
+    """
+    Read frames of a version 2.x file in random order, one at a time.
+    """
+    n_bytes = 0
+    with winspec.Winspec(context["winspec"], cache=False) as reader:
+        for index in context["random_frames"]:
+            n_bytes += reader.frame(index).nbytes
+    return(n_bytes, 1)
+
+@scenario
+def winspec_memmap_random_frames(context):
+    """
+    Copy frames of a memory-mapped version 2.x file in random order.
+    """
+    n_bytes = 0
+    with winspec.Winspec(context["winspec"],
+                         memmap=True,
+                         cache=False) as reader:
+        for index in context["random_frames"]:
+            n_bytes += numpy.array(reader[index]).nbytes
+    return(n_bytes, 1)
+
+@scenario
+def lightfield_footer(context):
+    """
+    Parse the footer settings and frame formats of every version 3.0 file.
+    """
+    n_bytes = 0
+    for path in context["lightfield_files"]:
+        with winspec.Lightfield(path, cache=False) as reader:
+            reader.exposure_time()
+            reader.temperature_read()
+            reader.frame_formats()
+            n_bytes += (os.path.getsize(path)
+                        - reader.header().xml_footer_offset)
+    return(n_bytes, len(context["lightfield_files"]))
+
+@scenario
+def lightfield_frames(context):
+    """
+    Decode every frame of a version 3.0 file as Frame objects.
+    """
+    n_frames = 0
+    with winspec.Lightfield(context["lightfield"], cache=False) as reader:
+        for frame in reader.frames():
+            n_frames += 1
+        stride = reader.frame_format().stride
+    return(n_frames*stride, 1)
+
+@scenario
+def lightfield_regions(context):
+    """
+    Copy every region of every frame of a version 3.0 file out of the memory
+    map.
+    """
+    n_bytes = 0
+    with winspec.Lightfield(context["lightfield"], cache=False) as reader:
+        for index in range(len(reader.frame_format().regions)):
+            n_bytes += numpy.array(reader.regions(index)).nbytes
+    return(n_bytes, 1)
+
+@scenario
+def lightfield_metadata(context):
+    """
+    Read the per-frame metadata of a version 3.0 file.
+    """
+    with winspec.Lightfield(context["lightfield"], cache=False) as reader:
+        metadata = reader.frame_metadata()
+    return(sum(value.nbytes for value in metadata.values()), 1)
+
+@scenario
+def winspec_write(context):
+    """
+    Write a version 2.x file from an array in memory.
+    """
+    stream = io.BytesIO()
+    write_winspec(context["frames"], stream)
+    return(context["frames"].nbytes, 1)
+
+def run(context, repeat=3, names=None):
+    """
+    Run the scenarios (all, or those named) and return a list of result
+    records, keeping the best of repeat runs of each.
+    """
+    results = list()
+
+    for function in SCENARIOS:
+        if names and function.__name__ not in names:
+            continue
+
+        best = None
+        for attempt in range(repeat):
+            start = time.perf_counter()
+            n_bytes, n_files = function(context)
+            elapsed = time.perf_counter() - start
+            if best is None or elapsed < best:
+                best = elapsed
+
+        best = max(best, 1e-9)
+        results.append({"scenario": function.__name__,
+                        "description": " ".join(function.__doc__.split()),
+                        "seconds": best,
+                        "bytes": n_bytes,
+                        "files": n_files,
+                        "mb_per_s": n_bytes/best/1e6,
+                        "files_per_s": n_files/best})
+        sys.stderr.write("{0:30s} {1:10.4f} s {2:10.1f} MB/s "
+                         "{3:10.1f} files/s\n".format(
+                             function.__name__,
+                             best,
+                             n_bytes/best/1e6,
+                             n_files/best))
+
+    return(results)
+
+def winspec_version():
+    try:
+        import importlib.metadata
+        return(importlib.metadata.version("winspec"))
+    except Exception:
+        return(None)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Benchmark the winspec readers and writers.")
+    parser.add_argument("--frames", type=int, default=100,
+                        help="Frames in the large files.")
+    parser.add_argument("--height", type=int, default=100)
+    parser.add_argument("--width", type=int, default=1340)
+    parser.add_argument("--regions", type=int, default=2,
+                        help="Regions per version 3.0 frame.")
+    parser.add_argument("--files", type=int, default=200,
+                        help="Small files for the per-file scenarios.")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--scenario", action="append",
+                        help="Run only this scenario (may be repeated).")
+    parser.add_argument("--directory",
+                        help="Where to write the synthetic files "
+                        "(default: a temporary directory).")
+    parser.add_argument("--output",
+                        help="JSON file for the results "
+                        "(default: standard output).")
+    args = parser.parse_args(argv)
+
+    directory = args.directory or tempfile.mkdtemp(prefix="winspec-bench-")
+    shape = (args.height, args.width)
+    region_height = max(1, args.height // args.regions)
+    regions = [(region_height, args.width)]*args.regions
+
+    try:
+        context = {"winspec": os.path.join(directory, "large-v2.spe"),
+                   "lightfield": os.path.join(directory, "large-v3.spe"),
+                   "winspec_files": list(),
+                   "lightfield_files": list()}
+        synthetic.make_winspec(context["winspec"], args.frames, shape)
+        synthetic.make_lightfield(context["lightfield"], args.frames,
+                                  regions)
+
+        for index in range(args.files):
+            path = os.path.join(directory, "small-v2-{0}.spe".format(index))
+            synthetic.make_winspec(path, 1, (1, args.width), seed=index)
+            context["winspec_files"].append(path)
+
+            path = os.path.join(directory, "small-v3-{0}.spe".format(index))
+            synthetic.make_lightfield(path, 1, [(1, args.width)], seed=index)
+            context["lightfield_files"].append(path)
+
+        context["random_frames"] = random.Random(0).sample(
+            range(args.frames), min(args.frames, 100))
+        with winspec.Winspec(context["winspec"], cache=False) as reader:
+            context["frames"] = reader.data()
+
+        results = {"version": winspec_version(),
+                   "python": platform.python_version(),
+                   "numpy": numpy.__version__,
+                   "platform": platform.platform(),
+                   "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                   "parameters": vars(args),
+                   "results": run(context, args.repeat, args.scenario)}
+    finally:
+        if not args.directory:
+            shutil.rmtree(directory)
+
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(results, output, indent=2)
+    else:
+        json.dump(results, sys.stdout, indent=2)
+        sys.stdout.write("\n")
+
+if __name__ == "__main__":
+    main()
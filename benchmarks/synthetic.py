@@ -0,0 +1,222 @@
+# 
+# Copyright (c) 2011-2014, Thomas Bischof
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without 
+# modification, are permitted provided that the following conditions are met:
+# 
+# 1. Redistributions of source code must retain the above copyright notice, 
+#    this list of conditions and the following disclaimer.
+# 
+# 2. Redistributions in binary form must reproduce the above copyright notice, 
+#    this list of conditions and the following disclaimer in the documentation 
+#    and/or other materials provided with the distribution.
+# 
+# 3. Neither the name of the Massachusetts Institute of Technology nor the 
+#    names of its contributors may be used to endorse or promote products 
+#    derived from this software without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" 
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE 
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE 
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE 
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR 
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF 
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS 
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN 
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) 
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE 
+# POSSIBILITY OF SUCH DAMAGE.
+# 
+
+
+"""
+Generators of synthetic SPE files of configurable size, for benchmarks.
+Version 2.x files are written through winspec_v2_4_header_t; version 3.0
+files have multi-region frames, per-frame metadata and a full XML footer
+(data format, metadata format, calibrations and acquisition settings).
+Frames are generated and written a chunk at a time, so files larger than
+memory can be made.
+"""
+
+import xml.etree.ElementTree
+
+import numpy
+
+from winspec.Lightfield import NAMESPACE, PIXEL_FORMATS, pack_header
+from winspec.Winspec import new_header, data_header, data_type_index
+from winspec.writer import Writer
+
+CHUNK_BYTES = 64 << 20
+
+def random_frames(random, n_frames, shape, dtype):
+    """
+    Return n_frames frames of noise of the given shape and dtype.
+    """
+    dtype = numpy.dtype(dtype)
+    if dtype.kind == "f":
+        return((random.random((n_frames,) + shape)*1000).astype(dtype))
+    else:
+        return(random.integers(0, 4096, size=(n_frames,) + shape,
+                               dtype=dtype))
+
+def make_winspec(filename, n_frames=100, shape=(100, 1340),
+                 dtype=numpy.uint16, seed=0):
+    """
+    Write a version 2.x file of n_frames noise frames, with an x calibration.
+    """
+    random = numpy.random.default_rng(seed)
+    header = new_header()
+    header.exp_sec = 0.1
+    header.DetTemperature = -70.0
+    header.x_calibration.polynom_order = 2
+    header.x_calibration.polynom_coeff = [400.0, 0.1, 1e-6, 0, 0, 0]
+    header.x_calibration.string = "nm"
+
+    chunk_frames = max(1, CHUNK_BYTES // (numpy.dtype(dtype).itemsize
+                                          * shape[0]*shape[1]))
+
+    with Writer(filename, shape, dtype, header=header) as writer:
+        for start in range(0, n_frames, chunk_frames):
+            writer.write(random_frames(random,
+                                       min(chunk_frames, n_frames - start),
+                                       shape,
+                                       dtype))
+
+def lightfield_footer(n_frames, regions, pixel_format, sensor_width,
+                      metadata=True):
+    """
+    Return the XML footer of a version 3.0 file with the given regions,
+    each a (height, width) at full resolution, stacked down the sensor.
+    """
+    element = xml.etree.ElementTree.Element
+    sub = xml.etree.ElementTree.SubElement
+
+    item_size = numpy.dtype(pixel_format).itemsize
+    frame_size = sum(height*width*item_size for height, width in regions)
+    metadata_size = 3*8 if metadata else 0
+
+    root = element("SpeFormat", {"version": "3.0", "xmlns": NAMESPACE})
+    data_format = sub(root, "DataFormat")
+    frame_attributes = {"type": "Frame",
+                        "version": "3.0",
+                        "count": str(n_frames),
+                        "pixelFormat": PIXEL_FORMATS[pixel_format],
+                        "size": str(frame_size),
+                        "stride": str(frame_size + metadata_size),
+                        "calibrations": "1,2"}
+    if metadata:
+        frame_attributes["metaFormat"] = "1"
+    frame = sub(data_format, "DataBlock", frame_attributes)
+
+    for index, (height, width) in enumerate(regions):
+        sub(frame, "DataBlock", {"type": "Region",
+                                 "count": "1",
+                                 "width": str(width),
+                                 "height": str(height),
+                                 "size": str(height*width*item_size),
+                                 "stride": str(height*width*item_size),
+                                 "calibrations": str(3 + index)})
+
+    if metadata:
+        meta_block = sub(sub(root, "MetaFormat"), "MetaBlock", {"id": "1"})
+        for event in ("ExposureStarted", "ExposureEnded"):
+            sub(meta_block, "TimeStamp", {"event": event,
+                                          "type": "Int64",
+                                          "bitDepth": "64",
+                                          "resolution": "1000000",
+                                          "absoluteTime":
+                                          "2014-01-01T00:00:00.0000000Z"})
+        sub(meta_block, "FrameTrackingNumber", {"type": "Int64",
+                                                "bitDepth": "64"})
+
+    sensor_height = sum(height for height, width in regions)
+    calibrations = sub(root, "Calibrations")
+    wavelength = sub(sub(calibrations, "WavelengthMapping", {"id": "1"}),
+                     "Wavelength", {"xml:space": "preserve"})
+    wavelength.text = ",".join("{0:.4f}".format(400 + 0.1*pixel)
+                               for pixel in range(sensor_width))
+    sub(calibrations, "SensorInformation", {"id": "2",
+                                            "width": str(sensor_width),
+                                            "height": str(sensor_height)})
+    row = 0
+    for index, (height, width) in enumerate(regions):
+        sub(calibrations, "SensorMapping", {"id": str(3 + index),
+                                            "x": "0",
+                                            "y": str(row),
+                                            "width": str(width),
+                                            "height": str(height),
+                                            "xBinning": "1",
+                                            "yBinning": "1"})
+        row += height
+
+    camera = root
+    for tag in ("DataHistories", "DataHistory", "Origin", "Experiment",
+                "Devices", "Cameras", "Camera"):
+        camera = sub(camera, tag)
+    for path, value in [("ShutterTiming/ExposureTime", "100"),
+                        ("Adc/AnalogGain", "Medium"),
+                        ("Adc/Speed", "2"),
+                        ("Acquisition/FrameRate", "9.5"),
+                        ("Acquisition/FramesPerReadout", "1"),
+                        ("Sensor/Temperature/SetPoint", "-70"),
+                        ("Sensor/Temperature/Reading", "-70"),
+                        ("ReadoutControl/Time", "100")]:
+        node = camera
+        for tag in path.split("/"):
+            found = node.find(tag)
+            node = found if found is not None else sub(node, tag)
+        node.text = value
+
+    return(b'<?xml version="1.0" encoding="utf-8"?>'
+           + xml.etree.ElementTree.tostring(root))
+
+def make_lightfield(filename, n_frames=100, regions=((100, 1340),),
+                    dtype=numpy.uint16, metadata=True, seed=0):
+    """
+    Write a version 3.0 file of n_frames frames, each holding the given
+    regions of noise followed (if metadata) by start and end timestamps and
+    a frame tracking number.
+    """
+    random = numpy.random.default_rng(seed)
+    dtype = numpy.dtype(dtype).newbyteorder("<")
+    pixel_format = dtype.char
+    sensor_width = max(width for height, width in regions)
+
+    fields = [("region{0}".format(index), dtype, shape)
+              for index, shape in enumerate(regions)]
+    if metadata:
+        fields += [("TimeStamp", "<i8", (2,)),
+                   ("FrameTrackingNumber", "<i8")]
+    frame_dtype = numpy.dtype(fields)
+
+    height, width = regions[0]
+    header = bytearray(data_header(new_header(), n_frames, height, width,
+                                   data_type_index(dtype)).to_bytes())
+    pack_header(header, file_header_ver=3.0)
+
+    chunk_frames = max(1, CHUNK_BYTES // frame_dtype.itemsize)
+
+    with open(filename, "wb") as dst_stream:
+        dst_stream.write(header)
+
+        for start in range(0, n_frames, chunk_frames):
+            count = min(chunk_frames, n_frames - start)
+            frames = numpy.zeros(count, dtype=frame_dtype)
+            for index, shape in enumerate(regions):
+                frames["region{0}".format(index)] = random_frames(
+                    random, count, shape, dtype)
+            if metadata:
+                tracking = numpy.arange(start, start + count)
+                frames["TimeStamp"][:, 0] = tracking*100000
+                frames["TimeStamp"][:, 1] = tracking*100000 + 50000
+                frames["FrameTrackingNumber"] = tracking + 1
+            dst_stream.write(frames.data)
+
+        footer_offset = dst_stream.tell()
+        dst_stream.write(lightfield_footer(n_frames, regions, pixel_format,
+                                           sensor_width, metadata))
+
+        pack_header(header, xml_footer_offset=footer_offset)
+        dst_stream.seek(0)
+        dst_stream.write(header)
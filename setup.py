@@ -5,6 +5,9 @@ setuptools.setup(name="winspec",
       author="Thomas Bischof", 
       author_email="tsbischof@gmail.com",
       packages=setuptools.find_packages(),
+      install_requires=["numpy"],
+      entry_points={"console_scripts":
+                    ["winspec-catalog = winspec.catalog:main"]},
       url="https://github.com/tsbischof/winspec"
 )
       
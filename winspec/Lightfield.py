@@ -30,9 +30,20 @@
 # 
 
 import struct
+import time
+import bisect
 import collections
+import io
 import operator
 import xml.dom.minidom
+import xml.etree.ElementTree
+
+import numpy
+
+from . import cache as cache_module
+from . import follow as follow_module
+from . import handles as handles_module
+from . import stats as stats_module
 
 lightfield_v3_0_header_t = [
     (1992, "file_header_ver", "f"),
@@ -50,6 +61,13 @@ lightfield_v3_0_header_t = [
     (4098, "lastvalue", "h")]
 
 ENDIANNESS = "<"
+DATA_OFFSET = 4100
+REGION_FIELD = "region{0}"
+
+EXPERIMENT = "DataHistories/DataHistory/Origin/Experiment"
+# The sections of the footer kept whole when it is indexed.
+FOOTER_SECTIONS = ("DataFormat", "MetaFormat", "Calibrations")
+CAMERA = EXPERIMENT + "/Devices/Cameras/Camera"
 
 DATATYPES = {
     6: "B",
@@ -65,6 +83,16 @@ DATATYPES = {
     "Int64": "q",
     "Double": "d"}
 
+NAMESPACE = "http://www.princetoninstruments.com/spe/2009"
+
+# The pixel formats which can be written, by struct type. This is not derived
+# from DATATYPES, which reads MonochromeUnsigned32 as signed: only unsigned
+# data may be written under that name.
+PIXEL_FORMATS = {
+    "f": "MonochromeFloating32",
+    "H": "MonochromeUnsigned16",
+    "I": "MonochromeUnsigned32"}
+
 FRAME_ATTR = ("Frame",
               [("calibrations", str),
                ("count", int),
@@ -100,6 +128,25 @@ METADATA_ATTR = {
                            ("monotonic", str)]
     }
 
+def make_attr(name, values):
+    """
+    Return a namedtuple type called name, with each of the (field, value)
+    pairs set as an attribute. This is the form read_attr produces.
+    """
+    result = collections.namedtuple(name,
+                                    map(operator.itemgetter(0), values))
+
+    for my_name, value in values:
+        setattr(result, my_name, value)
+
+    return(result)
+
+def attr_values(attr):
+    """
+    Return the (field, value) pairs of an attribute type made by make_attr.
+    """
+    return([(my_name, getattr(attr, my_name)) for my_name in attr._fields])
+
 def read_attr(attr, source, name=None):
     if not name:
         name = attr[0]
@@ -107,123 +154,534 @@ def read_attr(attr, source, name=None):
     else:
         attributes = attr
 
-        
-    result = collections.namedtuple(name,
-                                    map(operator.itemgetter(0),
-                                        attributes))
+    # source is a DOM or an ElementTree element.
+    if hasattr(source, "getAttribute"):
+        get = source.getAttribute
+    else:
+        get = lambda my_name: source.get(my_name, "")
 
+    values = list()
     for my_name, my_type in attributes:
         try:
-            setattr(result,
-                    my_name,
-                    my_type(source.getAttribute(my_name)))
+            values.append((my_name, my_type(get(my_name))))
         except ValueError:
-            setattr(result,
-                    my_name,
-                    source.getAttribute(my_name))
+            values.append((my_name, get(my_name)))
 
-    return(result)
+    return(make_attr(name, values))
+
+def make_footer(n_frames, height, width, pixel_format):
+    """
+    Return the XML footer describing n_frames frames, each holding a single
+    region of height x width pixels of the given struct type, without
+    metadata.
+    """
+    size = height*width*struct.calcsize(pixel_format)
+
+    root = xml.etree.ElementTree.Element("SpeFormat",
+                                         {"version": "3.0",
+                                          "xmlns": NAMESPACE})
+    data_format = xml.etree.ElementTree.SubElement(root, "DataFormat")
+    frame = xml.etree.ElementTree.SubElement(
+        data_format, "DataBlock",
+        {"type": "Frame",
+         "version": "3.0",
+         "count": str(n_frames),
+         "pixelFormat": PIXEL_FORMATS[pixel_format],
+         "size": str(size),
+         "stride": str(size)})
+    xml.etree.ElementTree.SubElement(
+        frame, "DataBlock",
+        {"type": "Region",
+         "count": "1",
+         "width": str(width),
+         "height": str(height),
+         "size": str(size),
+         "stride": str(size)})
+
+    return(b'<?xml version="1.0" encoding="utf-8"?>'
+           + xml.etree.ElementTree.tostring(root))
+
+def pack_header(buffer, **values):
+    """
+    Write the named fields of lightfield_v3_0_header_t into buffer, a
+    bytearray holding a header.
+    """
+    for offset, name, my_type in lightfield_v3_0_header_t:
+        if name in values:
+            struct.pack_into("{0}{1}".format(ENDIANNESS, my_type),
+                             buffer,
+                             offset,
+                             values[name])
+
+def unpack_header(buffer):
+    """
+    Return the (name, value) pairs of lightfield_v3_0_header_t, decoded from
+    buffer, which holds the header block of a file.
+    """
+    values = list()
+
+    for offset, name, my_type in lightfield_v3_0_header_t:
+        value = struct.unpack_from("{0}{1}".format(ENDIANNESS, my_type),
+                                   buffer,
+                                   offset)
+
+        if len(value) == 1:
+            value = value[0]
+
+        values.append((name, value))
+
+    return(values)
+
+def local_name(tag):
+    """
+    Strip the namespace from an ElementTree tag.
+    """
+    return(tag.rsplit("}", 1)[-1])
+
+def elements(element, tag):
+    """
+    Yield element and each element below it with the given tag, ignoring
+    namespaces.
+    """
+    for item in element.iter():
+        if local_name(item.tag) == tag:
+            yield(item)
+
+def index_footer(stream):
+    """
+    Parse the XML footer in a single streaming pass. Return a dictionary
+    mapping the path of each element under DataHistories (for example
+    DataHistories/DataHistory/Origin/Experiment/Devices/...) to its text,
+    and a dictionary of the FOOTER_SECTIONS elements found, by tag. Only the
+    first occurrence of each path is kept, and elements outside those
+    sections are discarded as soon as they are parsed. A malformed footer
+    yields whatever was found before the error.
+    """
+    settings = dict()
+    sections = dict((tag, list()) for tag in FOOTER_SECTIONS)
+    path = list()
+
+    try:
+        for event, element in xml.etree.ElementTree.iterparse(
+                stream, events=("start", "end")):
+            if event == "start":
+                path.append(local_name(element.tag))
+                continue
+
+            if len(path) > 1 and path[1] in FOOTER_SECTIONS:
+                if len(path) == 2:
+                    sections[path[1]].append(element)
+            else:
+                if len(path) > 1 and path[1] == "DataHistories" \
+                   and element.text is not None:
+                    settings.setdefault("/".join(path[1:]), element.text)
+
+                element.clear()
+
+            path.pop()
+    except xml.etree.ElementTree.ParseError:
+        # Keep whatever was parsed before the footer went bad, so that the
+        # accessors behave as though the missing settings were absent.
+        pass
+
+    return(settings, sections)
 
 class Region(object):
+    """
+    The pixels of one region of a frame, kept as the raw bytes of the file.
+    They are exposed without copying through memoryview (buffer()) and
+    numpy (numpy.asarray(region)); data() yields the rows as views.
+    """
     def __init__(self,
                  region_format,
-                 data):
-        self._calibration_x = None
-        self._calibration_y = None
-        self._data = data
+                 buffer,
+                 pixel_format,
+                 calibration_x=None,
+                 calibration_y=None):
+        self._calibration_x = calibration_x
+        self._calibration_y = calibration_y
+        self._buffer = buffer
+        self.pixel_format = pixel_format
         self.height = region_format.height
         self.width = region_format.width
 
     def x(self):
-        if not self._calibration_x:
-            return(None)
+        """
+        Return the calibrated x axis (wavelength) of the region, or None if
+        the file has no calibration for it.
+        """
+        return(self._calibration_x)
 
     def y(self):
-        if not self._calibration_y:
-            return(None)
+        """
+        Return the sensor row of each row of the region, or None if the file
+        does not map the region onto the sensor.
+        """
+        return(self._calibration_y)
+
+    def buffer(self):
+        """
+        Return a read-only memoryview of the pixels, of shape (height, width).
+        The file is little-endian; on a big-endian machine the view is of the
+        raw bytes instead, and numpy.asarray(region) should be used.
+        """
+        if not self.pixel_format.isnative:
+            return(self._buffer)
+
+        return(self._buffer.cast(self.pixel_format.char,
+                                 (self.height, self.width)))
+
+    def __buffer__(self, flags):
+        return(self.buffer())
+
+    def __array__(self, dtype=None, copy=None):
+        array = numpy.frombuffer(self._buffer,
+                                 dtype=self.pixel_format,
+                                 count=self.height*self.width).reshape(
+                                     self.height, self.width)
+
+        if dtype is not None and numpy.dtype(dtype) != array.dtype:
+            return(array.astype(dtype))
+        elif copy:
+            return(array.copy())
+        else:
+            return(array)
 
     def data(self):
-        for i in range(self.height):
-            yield(self._data[i*self.width:(i+1)*self.width])
+        for row in self.__array__():
+            yield(row)
 
-class Frame(object):
+def bin_axis(axis, binning):
+    """
+    Average each group of binning consecutive values of the axis.
+    """
+    binning = max(binning, 1)
+    n_bins = len(axis) // binning
+    return(numpy.asarray(axis[:n_bins*binning], dtype=numpy.float64).reshape(
+        n_bins, binning).mean(axis=1))
+
+class FrameFormat(object):
+    """
+    The layout of the frames in one data block, built once from the footer:
+    the frame and region attributes, the metadata items, the offset and size
+    of each region and the struct codecs used to decode the metadata.
+    """
     def __init__(self,
                  frame_format,
                  region_formats,
                  metadata_formats,
-                 data):
+                 region_axes=None):
+        self.frame = frame_format
+        self.regions = region_formats
+        self.metadata = metadata_formats
+        self.count = frame_format.count
+
+        if region_axes is None:
+            region_axes = [(None, None)]*len(region_formats)
+        self.region_axes = region_axes
+
+        pixel_format = DATATYPES[frame_format.pixelFormat]
+        self.pixel_format = numpy.dtype("{0}{1}".format(ENDIANNESS,
+                                                        pixel_format))
+
+        self.region_offsets = list()
+        self.region_sizes = list()
+        offset = 0
+
+        for region_format in region_formats:
+            if isinstance(region_format.size, int):
+                size = region_format.size
+            else:
+                size = self.pixel_format.itemsize \
+                       * region_format.height * region_format.width
+
+            self.region_offsets.append(offset)
+            self.region_sizes.append(size)
+
+            if isinstance(region_format.stride, int):
+                offset += region_format.stride
+            else:
+                offset += size
+
+        if isinstance(frame_format.size, int):
+            offset = frame_format.size
+
+        self.metadata_offsets = list()
+        self.metadata_codecs = list()
+
+        for metadata_type in metadata_formats:
+            codec = struct.Struct("{0}{1}".format(
+                ENDIANNESS, DATATYPES[metadata_type.type]))
+            self.metadata_offsets.append(offset)
+            self.metadata_codecs.append(codec)
+            offset += codec.size
+
+        if isinstance(frame_format.stride, int):
+            offset = max(offset, frame_format.stride)
+
+        self.stride = offset
+        self._dtype = None
+        self._metadata_fields = None
+
+    def region(self, index, buffer, offset=None):
+        """
+        Return region index of a frame, as a view of buffer. By default the
+        buffer holds the whole frame; otherwise the region starts at offset.
+        """
+        if offset is None:
+            offset = self.region_offsets[index]
+
+        return(Region(self.regions[index],
+                      buffer[offset:offset + self.region_sizes[index]],
+                      self.pixel_format,
+                      *self.region_axes[index]))
+
+    def metadata_span(self):
+        """
+        Return the (start, stop) byte offsets of the metadata in a frame.
+        """
+        if not self.metadata_offsets:
+            return(self.stride, self.stride)
+
+        return(self.metadata_offsets[0],
+               self.metadata_offsets[-1] + self.metadata_codecs[-1].size)
+
+    def decode_metadata(self, buffer, offset=0):
+        """
+        Return the metadata values of a frame held in buffer, which starts
+        offset bytes into the frame.
+        """
+        return([codec.unpack_from(buffer, item_offset - offset)
+                for item_offset, codec in zip(self.metadata_offsets,
+                                              self.metadata_codecs)])
+
+    def dtype(self):
+        """
+        Return the structured numpy dtype of a single frame, including any
+        padding up to the frame stride. Each region is a (height, width)
+        sub-array named region0, region1, ..., followed by the metadata
+        items. Consecutive metadata items with the same tag (such as the start
+        and end TimeStamp) are grouped into one sub-array field named after
+        the tag; a later run of the same tag gets a field of its own (see
+        metadata_fields).
+        """
+        if self._dtype is not None:
+            return(self._dtype)
+
+        names = list()
+        formats = list()
+        offsets = list()
+
+        for index, (region_format, offset) in enumerate(
+                zip(self.regions, self.region_offsets)):
+            names.append(REGION_FIELD.format(index))
+            formats.append((self.pixel_format,
+                            (region_format.height, region_format.width)))
+            offsets.append(offset)
+
+        n_regions = len(names)
+        shapes = list()
+        fields = dict()
+        for metadata_type, offset in zip(self.metadata,
+                                         self.metadata_offsets):
+            tag = metadata_type.__name__
+            item_format = numpy.dtype("{0}{1}".format(
+                ENDIANNESS, DATATYPES[metadata_type.type]))
+
+            if len(names) > n_regions and names[-1] == tag \
+               and formats[-1] == item_format:
+                shapes[-1] += 1
+            else:
+                if tag in names:
+                    tag = "{0}_{1}".format(tag, len(names))
+                names.append(tag)
+                formats.append(item_format)
+                offsets.append(offset)
+                shapes.append(1)
+                fields.setdefault(metadata_type.__name__, list()).append(tag)
+
+        # Single metadata items are stored as scalars, not 1-element arrays.
+        for index, shape in enumerate(shapes):
+            if shape > 1:
+                formats[n_regions + index] = (formats[n_regions + index],
+                                              (shape,))
+
+        self._metadata_fields = fields
+        self._dtype = numpy.dtype({"names": names,
+                                   "formats": formats,
+                                   "offsets": offsets,
+                                   "itemsize": self.stride})
+        return(self._dtype)
+
+    def metadata_fields(self):
+        """
+        Return the names of the dtype fields holding each metadata tag, in
+        frame order. Items of a tag which are not adjacent in the frame are
+        split across several fields, the later ones named <tag>_<n>.
+        """
+        self.dtype()
+        return(self._metadata_fields)
+
+class Frame(object):
+    """
+    One frame, kept as the raw bytes of its stride. data is either a stream
+    positioned at the frame, which is read into a new buffer, or a buffer
+    holding the frame. The regions are views of those bytes, and the frame
+    itself is exposed through buffer() and numpy.asarray(frame), as a record
+    of FrameFormat.dtype.
+    """
+    def __init__(self,
+                 frame_format,
+                 data,
+                 regions=None,
+                 metadata=True):
+        self.frame_format = frame_format
         self.regions = list()
         self._calibrations = list()
         self.metadata = list()
-        
-        pixel_format = DATATYPES[frame_format.pixelFormat]
 
-        for region_format in region_formats:
-            raw_data = data.read(region_format.size)
-
-            region_data = struct.unpack(
-                "{0}{1}{2}".format(
-                    ENDIANNESS,
-                    region_format.size // struct.calcsize(pixel_format),
-                    pixel_format),
-                raw_data)
-
-            self.regions.append(Region(region_format,
-                                        region_data))
-
-        metadata_id = frame_format.metaFormat
-        for metadata_format in filter(lambda x:
-                                      x.getAttribute("id") == metadata_id,
-                                      metadata_formats):
-            for item in metadata_format.childNodes:
-                metadata_type = read_attr(
-                    METADATA_ATTR[item.tagName],
-                    item,
-                    name=item.tagName)
-
-                fmt = "{0}{1}".format(
-                    ENDIANNESS,
-                    DATATYPES[metadata_type.type])
-
-                self.metadata.append(
-                    struct.unpack(
-                        fmt,
-                        data.read(struct.calcsize(fmt))))
-
-class Lightfield(object):
-    def __init__(self, filename):
+        if hasattr(data, "readinto"):
+            raw_data = bytearray(frame_format.stride)
+            n_bytes = data.readinto(raw_data)
+            if n_bytes != frame_format.stride:
+                raise(EOFError("Expected {0} bytes of frame, found {1}.".format(
+                    frame_format.stride, n_bytes)))
+            data = raw_data
+
+        self._buffer = memoryview(data).cast("B").toreadonly()
+
+        if regions is None:
+            regions = range(len(frame_format.regions))
+
+        for index in regions:
+            self.regions.append(frame_format.region(index, self._buffer))
+
+        if metadata:
+            self.metadata = frame_format.decode_metadata(self._buffer)
+
+    def buffer(self):
+        """
+        Return a read-only memoryview of the raw bytes of the frame.
+        """
+        return(self._buffer)
+
+    def __buffer__(self, flags):
+        return(self.buffer())
+
+    def __array__(self, dtype=None, copy=None):
+        array = numpy.frombuffer(self._buffer,
+                                 dtype=self.frame_format.dtype(),
+                                 count=1).reshape(())
+
+        if dtype is not None and numpy.dtype(dtype) != array.dtype:
+            return(array.astype(dtype))
+        elif copy:
+            return(array.copy())
+        else:
+            return(array)
+
+class LazyFrame(object):
+    """
+    A handle on one frame of a file, at a byte offset known from the footer.
+    Nothing is read until a region or the metadata is asked for, and then
+    only the bytes holding it are read.
+    """
+    def __init__(self,
+                 reader,
+                 frame_format,
+                 offset):
+        self._reader = reader
+        self.frame_format = frame_format
+        self.offset = offset
+        self._regions = dict()
+        self._metadata = None
+
+    def region(self, index):
+        """
+        Return one region of the frame, reading only its pixels.
+        """
+        if index not in self._regions:
+            buffer = bytearray(self.frame_format.region_sizes[index])
+            self._reader._read_into(
+                self.offset + self.frame_format.region_offsets[index],
+                buffer)
+            self._regions[index] = self.frame_format.region(
+                index, memoryview(buffer).toreadonly(), offset=0)
+
+        return(self._regions[index])
+
+    @property
+    def regions(self):
+        return([self.region(index)
+                for index in range(len(self.frame_format.regions))])
+
+    @property
+    def metadata(self):
+        if self._metadata is None:
+            start, stop = self.frame_format.metadata_span()
+            buffer = bytearray(stop - start)
+            if buffer:
+                self._reader._read_into(self.offset + start, buffer)
+            self._metadata = self.frame_format.decode_metadata(buffer,
+                                                               offset=start)
+
+        return(self._metadata)
+
+    def load(self):
+        """
+        Read the whole frame at once, returning it as a Frame.
+        """
+        return(self._reader._read_frame(self.frame_format, self.offset))
+
+class Lightfield(handles_module.FileReader):
+    def __init__(self, filename, cache=None, stats=None, header_data=None,
+                 handles=None):
         self.filename = filename
+        # The raw header block, when the caller has already read it.
+        self._header_data = header_data
+        self.stats = stats_module.make_stats(stats)
+        self._open_file(filename, cache=cache, handles=handles)
         self._header = None
         self._footer = None
+        self._footer_index = None
+        self._footer_cache = None
         self._frames = None
         self._frame_formats = None
+        self._data_blocks = None
+        self._formats = None
+        self._meta_blocks = None
+        self._calibrations = None
+        self._settings = None
+        self._frame_table = None
+        self._n_frames = None
+        self._firsts = None
 
     def header(self):
         if not self._header:
-            self._header = collections.namedtuple(
-                "LightfieldHeader",
-                map(operator.itemgetter(1),
-                    lightfield_v3_0_header_t))
-            
-            with open(self.filename, "rb") as data_file:
-                for offset, name, my_type in sorted(lightfield_v3_0_header_t):
-                    my_type =  "{0}{1}".format(ENDIANNESS,
-                                               my_type)
-
-                    data_file.seek(offset)
-                    setattr(self._header,
-                            name,
-                            struct.unpack(
-                                my_type,
-                                data_file.read(struct.calcsize(my_type))))
-
-                    if len(getattr(self._header, name)) == 1:
-                        setattr(self._header,
-                                name,
-                                getattr(self._header, name)[0])
+            with stats_module.timer(self.stats, "header"):
+                # The header is not cached: one read of it is cheaper than
+                # a lookup.
+                if self._header_data is not None:
+                    values = unpack_header(self._header_data)
+                else:
+                    values = self._read_header()
+
+                self._header = make_attr("LightfieldHeader", values)
             
         return(self._header)
 
+    def _release(self):
+        self._data_blocks = None
+
+    def _read_header(self):
+        with self._handle() as data_file:
+            data = handles_module.read_at(data_file, 0, DATA_OFFSET)
+
+        if self.stats is not None:
+            self.stats.read(len(data))
+
+        return(unpack_header(data))
+
     def frame_width(self):
         return(self.header().xdim)
 
@@ -231,92 +689,527 @@ class Lightfield(object):
         return(self.header().ydim)
 
     def footer(self):
+        """
+        Return the XML footer as a DOM. The readers do not use it, but index
+        the footer instead (see index_footer).
+        """
         if not self._footer:
-            with open(self.filename, "r") as data_file:
-                data_file.seek(self.header().xml_footer_offset)
-                
+            with stats_module.timer(self.stats, "footer", part="dom"):
                 self._footer = xml.dom.minidom.parseString(
-                    data_file.read())
+                    self._read_footer())
 
         return(self._footer)
 
-    def frames(self):
-        with open(self.filename, "rb") as data_file:
-            data_file.seek(4100)
+    def _read_footer(self):
+        offset = self.header().xml_footer_offset
+        with self._handle() as data_file:
+            text = handles_module.read_at(data_file, offset)
+
+        if self.stats is not None:
+            self.stats.read(len(text))
+
+        return(text)
+
+    def footer_index(self):
+        """
+        Return the settings and the sections of the footer, as index_footer.
+        The footer is read and parsed once, for the settings, the formats
+        and the calibrations alike.
+        """
+        if self._footer_index is None:
+            with stats_module.timer(self.stats, "footer", part="index"):
+                self._footer_index = index_footer(
+                    io.BytesIO(self._read_footer()))
+
+        return(self._footer_index)
+
+    def frames(self,
+               start=None,
+               stop=None,
+               step=None,
+               regions=None,
+               metadata=True,
+               lazy=False):
+        """
+        Yield the frames of the file, across all data blocks in file order.
+        start, stop and step select frames as a slice would. regions is a
+        list of the indices of the regions to read (by default, all of them),
+        and metadata whether to read the metadata; anything not selected is
+        skipped over rather than read. With lazy, yield a LazyFrame for each
+        frame instead, which reads nothing until it is used.
+        """
+        stats = self.stats
+
+        # there are some number of data blocks, which contain
+        # some number of frames, each of which contains some number
+        # of regions and some amount of metadata. The frames are a fixed
+        # stride apart, so each selected frame is found from its offset.
+
+        for index in range(*slice(start, stop, step).indices(len(self))):
+            frame_format, offset = self.frame_offset(index)
 
-            # there are some number of data blocks, which contain
-            # some number of frames, each of which contains some number
-            # of regions and some amount of metadata. Read in each frame,
-            # then parse the raw data to obtain the regions and metadata
+            if lazy:
+                yield(LazyFrame(self, frame_format, offset))
+                continue
 
-            for data_block in self.frame_formats():
-                for frame, regions, metadata in data_block:
-                    for frame_number in range(frame.count):
-                        yield(Frame(frame,
-                                    regions,
-                                    metadata,
-                                    data_file))
+            begin = time.perf_counter()
+            frame = self._read_frame(frame_format,
+                                     offset,
+                                     regions=regions,
+                                     metadata=metadata)
+            if stats is not None:
+                stats.decoded(1, time.perf_counter() - begin)
+            yield(frame)
+
+    def frame_table(self):
+        """
+        Return the offset table of the frames: for each data block in file
+        order, the index of its first frame, its frame format and its byte
+        offset. The frames of a block are its stride apart, so this locates
+        any frame without reading the file.
+        """
+        if self._frame_table is None:
+            table = list()
+            first = 0
+
+            for frame_format, offset in self._blocks():
+                table.append((first, frame_format, offset))
+                first += frame_format.count
+
+            # Set the table last, so that other threads see all of it or
+            # none of it.
+            self._n_frames = first
+            self._firsts = [first for first, frame_format, offset in table]
+            self._frame_table = table
+
+        return(self._frame_table)
+
+    def frame_offset(self, index):
+        """
+        Return the frame format and the byte offset of frame index, counting
+        frames across all data blocks. Negative indices count from the end.
+        """
+        table = self.frame_table()
+        n_frames = self._n_frames
+
+        if not -n_frames <= index < n_frames:
+            raise(IndexError("Frame {0} out of range for {1} frames.".format(
+                index, n_frames)))
+        if index < 0:
+            index += n_frames
+
+        first, frame_format, offset = table[
+            bisect.bisect_right(self._firsts, index) - 1]
+        return(frame_format, offset + (index - first)*frame_format.stride)
+
+    def frame(self, index, regions=None, metadata=True):
+        """
+        Return frame index, counting across all data blocks, read with a
+        single positioned read (or only the selected regions and metadata).
+        """
+        frame_format, offset = self.frame_offset(int(index))
+        return(self._read_frame(frame_format,
+                                offset,
+                                regions=regions,
+                                metadata=metadata))
+
+    def __len__(self):
+        self.frame_table()
+        return(self._n_frames)
+
+    def __getitem__(self, key):
+        """
+        Return a Frame for an integer, and a list of Frames for a slice, a
+        sequence of integers or a boolean mask.
+        """
+        if isinstance(key, (int, numpy.integer)):
+            return(self.frame(key))
+        elif isinstance(key, slice):
+            return(list(self.frames(key.start, key.stop, key.step)))
+
+        indices = numpy.asarray(key)
+        if indices.dtype == numpy.bool_:
+            if indices.shape != (len(self),):
+                raise(IndexError("Expected a mask of {0} frames.".format(
+                    len(self))))
+            indices = numpy.flatnonzero(indices)
+        elif indices.shape == (0,):
+            # An empty list is an array of floats.
+            return([])
+        elif indices.ndim != 1 or not numpy.issubdtype(indices.dtype,
+                                                        numpy.integer):
+            raise(IndexError("Frames are indexed by integers, slices, "
+                             "integer arrays or boolean masks."))
+
+        return([self.frame(index) for index in indices])
+
+    def _blocks(self):
+        """
+        Return the frame format and the byte offset of each data block, in
+        file order.
+        """
+        blocks = list()
+        offset = DATA_OFFSET
+
+        for data_block in self.frame_formats():
+            for frame_format in data_block:
+                blocks.append((frame_format, offset))
+                offset += frame_format.count*frame_format.stride
+
+        return(blocks)
+
+    def _read_into(self, offset, buffer):
+        """
+        Fill buffer with the bytes of the file from offset on.
+        """
+        with self._handle() as data_file:
+            n_bytes = handles_module.read_into(data_file, offset, buffer)
+
+        if self.stats is not None:
+            self.stats.read(n_bytes)
+
+        if n_bytes != len(buffer):
+            raise(EOFError("Expected {0} bytes at {1}, found {2}.".format(
+                len(buffer), offset, n_bytes)))
+
+    def _read_frame(self, frame_format, offset, regions=None, metadata=True):
+        """
+        Read the frame at offset, reading only the selected regions (and
+        metadata) when not all of the frame is wanted.
+        """
+        buffer = bytearray(frame_format.stride)
+        all_regions = list(range(len(frame_format.regions)))
+        if regions is None:
+            regions = all_regions
+        regions = list(regions)
+
+        if metadata and regions == all_regions:
+            self._read_into(offset, buffer)
+        else:
+            view = memoryview(buffer)
+            for index in regions:
+                begin = frame_format.region_offsets[index]
+                end = begin + frame_format.region_sizes[index]
+                self._read_into(offset + begin, view[begin:end])
+
+            begin, end = frame_format.metadata_span()
+            if metadata and end > begin:
+                self._read_into(offset + begin, view[begin:end])
+
+        return(Frame(frame_format, buffer, regions=regions, metadata=metadata))
+
+    def formats(self):
+        """
+        Return a plain description of the data and metadata formats in the
+        footer: the items of each MetaBlock, and for each frame data block
+        the attributes of the frame and its regions, its metadata items and
+        the region axes. This is what the cache stores in place of the
+        footer, along with the settings.
+        """
+        if self._formats is None:
+            self._formats = self._footer_values()["formats"]
+
+        return(self._formats)
+
+    def _footer_values(self):
+        """
+        Return the settings and formats of the footer, through the cache as
+        a single entry, so that a reader costs one lookup.
+        """
+        if self._footer_cache is None:
+            with stats_module.timer(self.stats, "footer", part="values"):
+                self._footer_cache = cache_module.lookup(
+                    self._cache,
+                    self.filename,
+                    "lightfield.footer",
+                    lambda: {"settings": self._read_settings(),
+                             "formats": self._read_formats()})
+
+        return(self._footer_cache)
+
+    def _read_formats(self):
+        settings, sections = self.footer_index()
+
+        meta_blocks = dict()
+        for meta_format in sections["MetaFormat"]:
+            for meta_block in elements(meta_format, "MetaBlock"):
+                meta_blocks[meta_block.get("id", "")] = [
+                    (local_name(item.tag),
+                     attr_values(read_attr(METADATA_ATTR[local_name(item.tag)],
+                                           item,
+                                           name=local_name(item.tag))))
+                    for item in meta_block]
+
+        frame_formats = list()
+        for data_format in sections["DataFormat"]:
+            frame_formats.append(list())
+            for frame in elements(data_format, "DataBlock"):
+                if frame.get("type") != "Frame":
+                    continue
+
+                frame_format = read_attr(FRAME_ATTR, frame)
+                regions = [read_attr(REGION_ATTR, region)
+                           for region in elements(frame, "DataBlock")
+                           if region.get("type") == "Region"]
+
+                # Get the metadata associated with the frame
+                metadata = list()
+                for meta_format in frame.get("metaFormat", "").split(","):
+                    metadata.extend(meta_blocks.get(meta_format, []))
+
+                frame_formats[-1].append(
+                    {"frame": attr_values(frame_format),
+                     "regions": [attr_values(region) for region in regions],
+                     "metadata": metadata,
+                     "axes": [self.region_axes(frame_format, region)
+                              for region in regions]})
+
+        return({"meta_blocks": meta_blocks,
+                "frame_formats": frame_formats})
+
+    def follow(self, stride=None, interval=0.1, timeout=None):
+        """
+        Yield each frame as a 2-D array as soon as it is written, following
+        the file as it grows during an acquisition. Until the footer is
+        written the frame layout is not known, so frames are taken to be a
+        single region of the header dimensions and datatype, stride bytes
+        apart (by default, with no metadata). Iteration stops once the
+        footer appears and every frame before it has been yielded, or once
+        no new frame has arrived for timeout seconds.
+        """
+        header = self.header()
+        footer_field = [(offset, my_type)
+                        for offset, name, my_type in lightfield_v3_0_header_t
+                        if name == "xml_footer_offset"][0]
+        footer_codec = struct.Struct("{0}{1}".format(ENDIANNESS,
+                                                     footer_field[1]))
+
+        def end(data_file):
+            data_file.seek(footer_field[0])
+            return(footer_codec.unpack(data_file.read(footer_codec.size))[0])
+
+        return(follow_module.follow(self.filename,
+                                    (header.ydim, header.xdim),
+                                    "{0}{1}".format(ENDIANNESS,
+                                                    DATATYPES[header.datatype]),
+                                    DATA_OFFSET,
+                                    stride=stride,
+                                    end=end,
+                                    interval=interval,
+                                    timeout=timeout))
+
+    def meta_blocks(self):
+        """
+        Return the metadata items of each MetaBlock in the footer, keyed by
+        the id of the block.
+        """
+        if self._meta_blocks is None:
+            self._meta_blocks = dict(
+                (block_id, [make_attr(tag, values) for tag, values in items])
+                for block_id, items in self.formats()["meta_blocks"].items())
+
+        return(self._meta_blocks)
 
     def frame_formats(self):
-        if not self._frame_formats:
-            self._frame_formats = list()
-
-            for data_format in self.footer().getElementsByTagName("DataFormat"):
-                self._frame_formats.append(list())
-                for frame in filter(\
-                    lambda x: x.getAttribute("type") == "Frame", \
-                    data_format.getElementsByTagName("DataBlock")):
-
-                    self._frame_formats[-1].append(
-                        [read_attr(FRAME_ATTR, frame),
-                         list(),
-                         list()])
-
-                    for region in filter( \
-                        lambda x: \
-                        x.getAttribute("type") == "Region",
-                        frame.getElementsByTagName("DataBlock")):
-                        
-                        self._frame_formats[-1][-1][1].append(
-                            read_attr(REGION_ATTR, region))
-
-                    try:
-                        # Get the metadata associated with the frame
-                        for meta_format in \
-                            frame.getAttribute("metaFormat").split(","):
-                            metadata = list(
-                                filter(lambda x:
-                                       x.getAttribute("id") == meta_format,
-                                       self.footer(
-                                           ).getElementsByTagName(
-                                               "MetaFormat")[
-                                                   0].getElementsByTagName(
-                                                   "MetaBlock")))[0]
-                            
-                            self._frame_formats[-1][-1][2].append(metadata)
-                    except:
-                        pass      
+        """
+        Return the FrameFormat of each frame data block, grouped by
+        DataFormat. These are built once, with the metadata resolved through
+        the MetaBlock index.
+        """
+        if self._frame_formats is None:
+            self._frame_formats = [
+                [FrameFormat(make_attr(FRAME_ATTR[0], block["frame"]),
+                             [make_attr(REGION_ATTR[0], values)
+                              for values in block["regions"]],
+                             [make_attr(tag, values)
+                              for tag, values in block["metadata"]],
+                             block["axes"])
+                 for block in data_format]
+                for data_format in self.formats()["frame_formats"]]
 
         return(self._frame_formats)
 
+    def frame_format(self, block=0):
+        """
+        Return the FrameFormat of the given frame data block, counting data
+        blocks in file order as data_blocks does.
+        """
+        return([frame_format
+                for data_format in self.frame_formats()
+                for frame_format in data_format][block])
+
+    def calibrations(self):
+        """
+        Return the entries of the Calibrations section of the footer, keyed
+        by id. Wavelength mappings are resolved to arrays; other entries
+        (such as SensorMapping) are the attributes of the element.
+        """
+        if self._calibrations is None:
+            self._calibrations = dict()
+
+            settings, sections = self.footer_index()
+
+            for section in sections["Calibrations"]:
+                for item in section:
+                    if not item.get("id"):
+                        continue
+
+                    tag = local_name(item.tag)
+                    if tag == "WavelengthMapping":
+                        value = None
+                        for child in elements(item, "Wavelength"):
+                            value = numpy.array([float(wavelength)
+                                                 for wavelength
+                                                 in (child.text or "").split(",")
+                                                 if wavelength.strip()])
+                    else:
+                        value = dict(item.attrib)
+
+                    self._calibrations[item.get("id")] = (tag, value)
+
+        return(self._calibrations)
+
+    def region_axes(self, frame_format, region_format):
+        """
+        Return the (x, y) axes of a region: the wavelength of each column and
+        the sensor row of each row. The calibrations of the frame and region
+        are combined, and the sensor axes are sliced to the region of
+        interest and averaged over its binning. Either axis is None if the
+        needed calibration is missing or does not match the region shape.
+        """
+        wavelength = None
+        mapping = None
+
+        for calibration_id in "{0},{1}".format(
+                frame_format.calibrations,
+                region_format.calibrations).split(","):
+            tag, value = self.calibrations().get(calibration_id,
+                                                 (None, None))
+            if tag == "WavelengthMapping":
+                wavelength = value
+            elif tag == "SensorMapping":
+                mapping = value
+
+        if mapping is None:
+            if wavelength is not None and len(wavelength) == region_format.width:
+                return(wavelength, None)
+            else:
+                return(None, None)
+
+        try:
+            x = int(mapping.get("x", 0))
+            y = int(mapping.get("y", 0))
+            width = int(mapping["width"])
+            height = int(mapping["height"])
+            x_binning = int(mapping.get("xBinning", 1))
+            y_binning = int(mapping.get("yBinning", 1))
+        except (KeyError, ValueError):
+            return(None, None)
+
+        if wavelength is not None:
+            wavelength = bin_axis(wavelength[x:x+width], x_binning)
+            if len(wavelength) != region_format.width:
+                wavelength = None
+
+        rows = bin_axis(numpy.arange(y, y+height), y_binning)
+        if len(rows) != region_format.height:
+            rows = None
+
+        return(wavelength, rows)
+
+    def axes(self, region=0, block=0):
+        """
+        Return the (x, y) axes of a region of the given data block.
+        """
+        return(self.frame_format(block).region_axes[region])
+
+    def data_blocks(self):
+        """
+        Return a read-only memory map of each frame data block in the file,
+        in file order. Each is a structured array with one record per frame,
+        with the layout given by FrameFormat.dtype.
+        """
+        self._check_open()
+        if self._data_blocks is None:
+            self._data_blocks = list()
+
+            for frame_format, offset in self._blocks():
+                dtype = frame_format.dtype()
+
+                if frame_format.count:
+                    block = numpy.memmap(self.filename,
+                                         dtype=dtype,
+                                         mode="r",
+                                         offset=offset,
+                                         shape=(frame_format.count,))
+                else:
+                    block = numpy.zeros((0,), dtype=dtype)
+
+                self._data_blocks.append(block)
+
+        return(self._data_blocks)
+
+    def regions(self, index, block=0):
+        """
+        Return the pixels of one region for every frame of the data block,
+        as an array of shape (n_frames, height, width).
+        """
+        return(self.data_blocks()[block][REGION_FIELD.format(index)])
+
+    def metadata(self, block=0):
+        """
+        Return a dictionary of the metadata of every frame of the data block,
+        keyed by metadata tag. Repeated tags such as the TimeStamp events
+        have shape (n_frames, n_items). These are views of the memory map,
+        except for tags whose items are not adjacent in the frame, which are
+        gathered into a copy.
+        """
+        data = self.data_blocks()[block]
+        frame_format = self._blocks()[block][0]
+
+        result = dict()
+        for tag, names in frame_format.metadata_fields().items():
+            if len(names) == 1:
+                result[tag] = data[names[0]]
+            else:
+                result[tag] = numpy.column_stack([data[name]
+                                                  for name in names])
+
+        return(result)
+
+    def frame_metadata(self):
+        """
+        Return a dictionary of the metadata of every frame in the file, keyed
+        by metadata kind (TimeStamp, FrameTrackingNumber, and so on). Each
+        value is an array with one row per frame, across all data blocks;
+        kinds which are missing from any data block are left out. TimeStamp
+        columns follow the order of the events in the MetaBlock.
+
+        The values are copied out of the memory maps field by field, so
+        pages holding only pixel data are never read.
+        """
+        blocks = [self.metadata(index)
+                  for index in range(len(self.data_blocks()))]
+
+        result = dict()
+        for kind in METADATA_ATTR:
+            if blocks and all(kind in block for block in blocks):
+                result[kind] = numpy.concatenate(
+                    [numpy.array(block[kind]) for block in blocks])
+
+        return(result)
+
     def n_frames(self):
         """
         Return the number of frames in the exposure.
         """
         try:
-            value = self.footer().getElementsByTagName(
-                "DataFormat")[0].getElementsByTagName(
-                    "DataBlock")[0].attributes["count"]
-            return(int(value.value))
+            return(self.frame_formats()[0][0].count)
         except IndexError:
             return(None)
 
     def pixel_format(self):
-        return(
-            DATATYPES[
-                self.footer().getElementsByTagName(
-                    "DataFormat")[0].getElementsByTagName(
-                        "DataBlock")[0].getAttribute("pixelFormat")])
+        return(DATATYPES[self.frame_formats()[0][0].frame.pixelFormat])
 
     def exposure_times(self):
         """
@@ -327,19 +1220,17 @@ class Lightfield(object):
         stop = None
 
         try:
-            timestamps = self.footer().getElementsByTagName(
-                "MetaFormat")[0].getElementsByTagName(
-                    "MetaBlock")[0].getElementsByTagName(
-                        "TimeStamp")
+            timestamps = [item
+                          for item in list(self.meta_blocks().values())[0]
+                          if item.__name__ == "TimeStamp"]
         except IndexError:
             timestamps = []
 
         for timestamp in timestamps:
-            event = timestamp.getAttribute("event")
-            if event == "ExposureStarted":
-                start = timestamp.getAttribute("absoluteTime")
-            elif event == "ExposureEnded":
-                stop = timestamp.getAttribute("absoluteTime")
+            if timestamp.event == "ExposureStarted":
+                start = timestamp.absoluteTime
+            elif timestamp.event == "ExposureEnded":
+                stop = timestamp.absoluteTime
         
         return(start, stop)
 
@@ -349,173 +1240,77 @@ class Lightfield(object):
     def exposure_stop(self):
         return(self.exposure_times()[1])
 
+    def settings(self):
+        """
+        Return the index of the acquisition settings stored in the footer,
+        mapping element paths to their text. The footer is parsed once, in a
+        streaming pass shared with the formats (see footer_index).
+        """
+        if self._settings is None:
+            self._settings = self._footer_values()["settings"]
+
+        return(self._settings)
+
+    def _read_settings(self):
+        return(self.footer_index()[0])
+
+    def setting(self, path):
+        """
+        Return the text of the setting at path, or None if it is not present.
+        """
+        return(self.settings().get(path))
+
     def exposure_time(self):
         """
         Return the exposure time for a frame, in ms.
         """
-        try:
-            value = self.footer().getElementsByTagName(
-                "DataHistories")[0].getElementsByTagName(
-                    "DataHistory")[0].getElementsByTagName(
-                        "Origin")[0].getElementsByTagName(
-                            "Experiment")[0].getElementsByTagName(
-                                "Devices")[0].getElementsByTagName(
-                                    "Cameras")[0].getElementsByTagName(
-                                        "Camera")[0].getElementsByTagName(
-                                            "ShutterTiming")[0].getElementsByTagName(
-                                                "ExposureTime")[0].childNodes[0]
-            return(value.data)
-        except:
-            return(None)
+        return(self.setting(CAMERA + "/ShutterTiming/ExposureTime"))
 
     def gain(self):
         """
         Return the gain setting.
         """
-        try:
-            value = self.footer().getElementsByTagName(
-                "DataHistories")[0].getElementsByTagName(
-                    "DataHistory")[0].getElementsByTagName(
-                        "Origin")[0].getElementsByTagName(
-                            "Experiment")[0].getElementsByTagName(
-                                "Devices")[0].getElementsByTagName(
-                                    "Cameras")[0].getElementsByTagName(
-                                        "Camera")[0].getElementsByTagName(
-                                            "Adc")[0].getElementsByTagName(
-                                                "AnalogGain")[0].childNodes[0]
-            return(value.data)
-        except:
-            return(None)
+        return(self.setting(CAMERA + "/Adc/AnalogGain"))
 
     def ad_rate(self):
         """
         Return the A/D conversion rate, in MHz.
         """
-        try:
-            value = self.footer().getElementsByTagName(
-                "DataHistories")[0].getElementsByTagName(
-                    "DataHistory")[0].getElementsByTagName(
-                        "Origin")[0].getElementsByTagName(
-                            "Experiment")[0].getElementsByTagName(
-                                "Devices")[0].getElementsByTagName(
-                                    "Cameras")[0].getElementsByTagName(
-                                        "Camera")[0].getElementsByTagName(
-                                            "Adc")[0].getElementsByTagName(
-                                                "Speed")[0].childNodes[0]
-            return(value.data)
-        except:
-            return(None)
+        return(self.setting(CAMERA + "/Adc/Speed"))
 
     def frame_rate(self):
         """
         Return the frame rate of acquisition.
         """
-        try:
-            value = self.footer().getElementsByTagName(
-                "DataHistories")[0].getElementsByTagName(
-                    "DataHistory")[0].getElementsByTagName(
-                        "Origin")[0].getElementsByTagName(
-                            "Experiment")[0].getElementsByTagName(
-                                "Devices")[0].getElementsByTagName(
-                                    "Cameras")[0].getElementsByTagName(
-                                        "Camera")[0].getElementsByTagName(
-                                            "Acquisition")[0].getElementsByTagName(
-                                                "FrameRate")[0].childNodes[0]
-            return(value.data)
-        except:
-            return(None)
+        return(self.setting(CAMERA + "/Acquisition/FrameRate"))
 
     def temperature_set(self):
         """
         Return the set temperature of the sensor.
         """
-        try:
-            value = self.footer().getElementsByTagName(
-                "DataHistories")[0].getElementsByTagName(
-                    "DataHistory")[0].getElementsByTagName(
-                        "Origin")[0].getElementsByTagName(
-                            "Experiment")[0].getElementsByTagName(
-                                "Devices")[0].getElementsByTagName(
-                                    "Cameras")[0].getElementsByTagName(
-                                        "Camera")[0].getElementsByTagName(
-                                            "Sensor")[0].getElementsByTagName(
-                                                "Temperature")[0].getElementsByTagName(
-                                                    "SetPoint")[0].childNodes[0]
-            return(value.data)
-        except:
-            return(None)
+        return(self.setting(CAMERA + "/Sensor/Temperature/SetPoint"))
 
     def temperature_read(self):
         """
         Return the read temperature of the sensor.
         """
-        try:
-            value = self.footer().getElementsByTagName(
-                "DataHistories")[0].getElementsByTagName(
-                    "DataHistory")[0].getElementsByTagName(
-                        "Origin")[0].getElementsByTagName(
-                            "Experiment")[0].getElementsByTagName(
-                                "Devices")[0].getElementsByTagName(
-                                    "Cameras")[0].getElementsByTagName(
-                                        "Camera")[0].getElementsByTagName(
-                                            "Sensor")[0].getElementsByTagName(
-                                                "Temperature")[0].getElementsByTagName(
-                                                    "Reading")[0].childNodes[0]
-            return(value.data)
-        except:
-            return(None)
+        return(self.setting(CAMERA + "/Sensor/Temperature/Reading"))
 
     def background_file(self):
         """
         Return the background file used for the acquisition.
         """
-        try:
-            value = self.footer().getElementsByTagName(
-                "DataHistories")[0].getElementsByTagName(
-                    "DataHistory")[0].getElementsByTagName(
-                        "Origin")[0].getElementsByTagName(
-                            "Experiment")[0].getElementsByTagName(
-                                "OnlineCorrections")[0].getElementsByTagName(
-                                    "BackgroundCorrection")[0].getElementsByTagName(
-                                        "ReferenceFile")[0].childNodes[0]
-            return(value.data)
-        except:
-            return(None)
+        return(self.setting(
+            EXPERIMENT + "/OnlineCorrections/BackgroundCorrection/ReferenceFile"))
 
     def readout_time(self):
         """
         Return the time required to read out a frame, in ms.
         """
-        try:
-            value = self.footer().getElementsByTagName(
-                "DataHistories")[0].getElementsByTagName(
-                    "DataHistory")[0].getElementsByTagName(
-                        "Origin")[0].getElementsByTagName(
-                            "Experiment")[0].getElementsByTagName(
-                                "Devices")[0].getElementsByTagName(
-                                    "Cameras")[0].getElementsByTagName(
-                                        "Camera")[0].getElementsByTagName(
-                                            "ReadoutControl")[0].getElementsByTagName(
-                                                "Time")[0].childNodes[0]
-            return(value.data)
-        except:
-            return(None)
+        return(self.setting(CAMERA + "/ReadoutControl/Time"))
 
     def frames_per_readout(self):
         """
         Return the number of frames exposed per frame read out.
         """
-        try:
-            value = self.footer().getElementsByTagName(
-                "DataHistories")[0].getElementsByTagName(
-                    "DataHistory")[0].getElementsByTagName(
-                        "Origin")[0].getElementsByTagName(
-                            "Experiment")[0].getElementsByTagName(
-                                "Devices")[0].getElementsByTagName(
-                                    "Cameras")[0].getElementsByTagName(
-                                        "Camera")[0].getElementsByTagName(
-                                            "Acquisition")[0].getElementsByTagName(
-                                                "FramesPerReadout")[0].childNodes[0]
-            return(value.data)
-        except:
-            return(None)
+        return(self.setting(CAMERA + "/Acquisition/FramesPerReadout"))
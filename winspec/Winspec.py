@@ -33,11 +33,19 @@ import struct
 import re
 import logging
 import os
-import collections
+import copy
+import functools
+import time
+
+import numpy
 
 #import matplotlib.pyplot as plt
 
 from . import cstruct
+from . import follow as follow_module
+from . import handles as handles_module
+from . import parallel
+from . import stats as stats_module
 
 winspec_v2_4_ROI_t = [
     ("startx", (1, "H")),
@@ -241,6 +249,8 @@ constants = {"HDRNAMEMAX": 120,
              "TIMEMAX": 7}
 
 data_types = ["f", "i", "h", "H"]
+ENDIANNESS = "<"
+DATA_OFFSET = 4100
 camera_types = ["", "new120", "old120", "ST130", "ST121", "ST138", "DC131",
                 "ST133", "ST135", "VICCD", "ST117", "OMA3", "OMA4"]
 
@@ -269,105 +279,305 @@ def parse_header(header):
         except:
             continue
 
-class Winspec:
-    def __init__(self, filename, version=(2, 4)):
+def calibration_axis(calibration, n_pixels):
+    """
+    Evaluate the calibration polynomial at each of n_pixels pixel indices,
+    using the coefficients up to polynom_order.
+    """
+    order = max(calibration.polynom_order + 1, 0)
+    return(polynomial_axis(tuple(calibration.polynom_coeff[:order]),
+                           n_pixels))
+
+@functools.lru_cache(maxsize=256)
+def polynomial_axis(coefficients, n_pixels):
+    """
+    Return the polynomial with the given coefficients (lowest power first)
+    evaluated at the pixel indices. The result is cached and shared between
+    files with the same calibration, so it is read-only.
+    """
+    if coefficients:
+        axis = numpy.polynomial.polynomial.polyval(
+            numpy.arange(n_pixels, dtype=numpy.float64),
+            coefficients)
+    else:
+        axis = numpy.zeros(n_pixels)
+
+    axis.flags.writeable = False
+    return(axis)
+
+class Winspec(handles_module.FileReader):
+    def __init__(self, filename, version=(2, 4), memmap=False, cache=None,
+                 stats=None, header_data=None, handles=None):
         self._header = None
+        # The raw header block, when the caller has already read it.
+        self._header_data = header_data
+        self.stats = stats_module.make_stats(stats)
         self._filename = filename
-        self._data_file = open(filename, "rb")
+        self._memmap = memmap
+        self._open_file(filename, cache=cache, handles=handles)
         self._x = None
         self._y = None
         
         self._frames = None
+        self._data = None
 
         self.header()
 
     def header(self):
         if self._header == None:
-            self._header = cstruct.CStruct(winspec_v2_4_header_t)
-            self._header.from_stream(self._data_file)
+            with stats_module.timer(self.stats, "header"):
+                # The header is not cached: one read of it is cheaper than
+                # a lookup.
+                if self._header_data is not None:
+                    data = self._header_data
+                else:
+                    data = self._read_header()
 
-            if self._data_file.tell() != 4100:
-                logging.error("Only read to {0}. "
-                              "The header should stop at {1}.".format(
-                                  self._data_file.tell(), 4100))
+                self._header = cstruct.CStruct(winspec_v2_4_header_t)
+                self._header.from_buffer(data)
 
         return(self._header)
 
-    def frames(self, iterator=False):
-        if iterator:
-            data_type = data_types[self.header().datatype]
-
-            n_frames = self.n_frames()
-            frame_width = self.frame_width()
-            frame_height = self.frame_height()
-
-            line_format = "{0}{1}".format(frame_width, data_type)
-            logging.debug("Reading {0} frames, at {1}x{2}.".format(
-                n_frames, frame_width, frame_height))
-            logging.debug("Format for a line: {0}.".format(line_format))
-
-            for frame_number in range(n_frames):
-                logging.debug("Reading frame {0}.".format(frame_number))
-                frame_data = list()
-                for line_number in range(frame_height):
-                    logging.debug("Reading line {0}.".format(line_number))
-                    raw_data = self._data_file.read(struct.calcsize(
-                        line_format))
-                    line_data = struct.unpack(line_format, raw_data)
+    def _release(self):
+        self._data = None
+
+    def _read_header(self):
+        with self._handle() as data_file:
+            data = handles_module.read_at(data_file, 0, DATA_OFFSET)
+        if self.stats is not None:
+            self.stats.read(len(data))
+
+        if len(data) != DATA_OFFSET:
+            logging.error("Only read to {0}. "
+                          "The header should stop at {1}.".format(
+                              len(data), DATA_OFFSET))
+
+        return(data)
+
+    def data_type(self):
+        """
+        Return the numpy dtype of the pixel data.
+        """
+        return(numpy.dtype("{0}{1}".format(ENDIANNESS,
+                                           data_types[self.header().datatype])))
+
+    def frame_bytes(self):
+        """
+        Return the size of a single frame in the file, in bytes.
+        """
+        return(self.frame_width()*self.frame_height()*
+               self.data_type().itemsize)
+
+    def data(self, processes=None):
+        """
+        Return all frames as an array of shape (n_frames, height, width),
+        read in bulk from the data section of the file. If the file was
+        opened with memmap=True, this is a read-only memory map instead and
+        only the pages which are accessed are read. With processes, the
+        frames are decoded in that many worker processes (see
+        parallel.decode).
+        """
+        self._check_open()
+        if self._data is None and self._memmap:
+            self._data = self._map_data()
+        elif self._data is None and processes:
+            start = time.perf_counter()
+            self._data = parallel.decode(self, processes=processes)
+            if self.stats is not None:
+                self.stats.decoded(len(self._data),
+                                   time.perf_counter() - start)
+        elif self._data is None:
+            shape = (self.n_frames(), self.frame_height(), self.frame_width())
+            frame_size = shape[1]*shape[2]
+
+            start = time.perf_counter()
+            data = self._read_pixels(DATA_OFFSET, shape[0]*frame_size)
+            if self.stats is not None:
+                self.stats.read(data.nbytes)
+                self.stats.decoded(data.size // max(frame_size, 1),
+                                   time.perf_counter() - start)
+
+            if data.size != shape[0]*frame_size:
+                logging.error("Expected {0} frames, but only found {1}.".format(
+                    shape[0], data.size // max(frame_size, 1)))
+                shape = (data.size // max(frame_size, 1),) + shape[1:]
+                data = data[:shape[0]*frame_size]
+
+            self._data = data.reshape(shape)
+
+        return(self._data)
+
+    def _map_data(self):
+        self._check_open()
+        shape = (self.n_frames(), self.frame_height(), self.frame_width())
+
+        available = max(os.path.getsize(self._filename) - DATA_OFFSET, 0) \
+                    // max(self.frame_bytes(), 1)
+        if available < shape[0]:
+            logging.error("Expected {0} frames, but only found {1}.".format(
+                shape[0], available))
+            shape = (available,) + shape[1:]
+
+        if shape[0]*shape[1]*shape[2] == 0:
+            # mmap refuses to map an empty region.
+            return(numpy.empty(shape, dtype=self.data_type()))
+
+        return(numpy.memmap(self._filename,
+                            dtype=self.data_type(),
+                            mode="r",
+                            offset=DATA_OFFSET,
+                            shape=shape))
+
+    def frame(self, index):
+        """
+        Return a single frame as an array of shape (height, width). Only that
+        frame is read from the file, unless the data are already loaded.
+        """
+        if self._data is not None or self._memmap:
+            return(self.data()[index])
+
+        n_frames = self.n_frames()
+        if index < 0:
+            index += n_frames
+        if not 0 <= index < n_frames:
+            raise(IndexError("Frame {0} out of range for {1} frames.".format(
+                index, n_frames)))
+
+        return(self.read_frames(index, index + 1)[0])
+
+    def read_frames(self, start, stop):
+        """
+        Read frames start to stop (clipped to the frames in the file) in one
+        read, as an array of shape (n_frames, height, width).
+        """
+        start = max(start, 0)
+        stop = min(stop, self.n_frames())
+        frame_size = self.frame_width()*self.frame_height()
+        count = max(stop - start, 0)*frame_size
+
+        begin = time.perf_counter()
+        data = self._read_pixels(DATA_OFFSET + start*self.frame_bytes(), count)
+        if self.stats is not None:
+            self.stats.read(data.nbytes)
+            self.stats.decoded(data.size // max(frame_size, 1),
+                               time.perf_counter() - begin)
+        if data.size != count:
+            raise(IndexError("Frames {0} to {1} are truncated.".format(
+                start, stop)))
+
+        return(data.reshape((-1, self.frame_height(), self.frame_width())))
+
+    def _read_pixels(self, offset, count):
+        """
+        Read up to count pixels from offset with a positioned read, which
+        does not disturb reads of the same handle in other threads.
+        """
+        data = numpy.empty(count, dtype=self.data_type())
+        with self._handle() as data_file:
+            n_bytes = handles_module.read_into(data_file, offset, data)
+
+        return(data[:n_bytes // data.itemsize])
+
+    def __len__(self):
+        if self._data is not None or self._memmap:
+            return(len(self.data()))
+        else:
+            return(self.n_frames())
 
-                    frame_data.append(line_data)
+    def __getitem__(self, key):
+        if isinstance(key, (int, numpy.integer)):
+            return(self.frame(key))
+        else:
+            return(self.data()[key])
 
-                yield(frame_data)
+    def frames(self, iterator=False, as_array=False):
+        if as_array:
+            for frame in self.data():
+                yield(frame)
+        elif iterator:
+            for frame in self._read_tuple_frames():
+                yield(frame)
         else:
             if not self._frames:
-                self._frames = list()
-                data_type = data_types[self.header().datatype]
-
-                n_frames = self.n_frames()
-                frame_width = self.frame_width()
-                frame_height = self.frame_height()
-
-                line_format = "{0}{1}".format(frame_width, data_type)
-                logging.debug("Reading {0} frames, at {1}x{2}.".format(
-                    n_frames, frame_width, frame_height))
-                logging.debug("Format for a line: {0}.".format(line_format))
-
-                for frame_number in range(n_frames):
-                    logging.debug("Reading frame {0}.".format(frame_number))
-                    frame_data = list()
-                    for line_number in range(frame_height):
-                        logging.debug("Reading line {0}.".format(line_number))
-                        raw_data = self._data_file.read(struct.calcsize(
-                            line_format))
-                        line_data = struct.unpack(line_format, raw_data)
-
-                        frame_data.append(line_data)
-
-                    self._frames.append(frame_data)
+                self._frames = list(self._read_tuple_frames())
 
             for frame in self._frames:
                 yield(frame)
 
+    def _read_tuple_frames(self):
+        data_type = data_types[self.header().datatype]
+
+        n_frames = self.n_frames()
+        frame_width = self.frame_width()
+        frame_height = self.frame_height()
+
+        line_format = struct.Struct("{0}{1}{2}".format(ENDIANNESS,
+                                                       frame_width,
+                                                       data_type))
+        logging.debug("Reading {0} frames, at {1}x{2}.".format(
+            n_frames, frame_width, frame_height))
+        logging.debug("Format for a line: {0}.".format(line_format.format))
+
+        frame_bytes = self.frame_bytes()
+        stats = self.stats
+
+        for frame_number in range(n_frames):
+            start = time.perf_counter()
+            frame_data = list()
+            with self._handle() as data_file:
+                raw_data = handles_module.read_at(
+                    data_file, DATA_OFFSET + frame_number*frame_bytes,
+                    frame_bytes)
+
+            for line_number in range(frame_height):
+                frame_data.append(line_format.unpack_from(
+                    raw_data, line_number*line_format.size))
+
+            if stats is not None:
+                stats.read(len(raw_data))
+                stats.decoded(1, time.perf_counter() - start)
+
+            yield(frame_data)
+
+    def follow(self, interval=0.1, timeout=None):
+        """
+        Yield each frame as a 2-D array as soon as it is written, following
+        the file as it grows during an acquisition. Stops once no new frame
+        has arrived for timeout seconds (by default, never).
+        """
+        return(follow_module.follow(self._filename,
+                                    (self.frame_height(), self.frame_width()),
+                                    self.data_type(),
+                                    DATA_OFFSET,
+                                    interval=interval,
+                                    timeout=timeout))
+
     def x(self):
-        # Get the calibration out and print the axis values.
-        if self._x:
-            return(self._x)
-        
-        line = list()
-        for pixel_index in range(self.header().xdim):
-            result = 0
-            for power, coefficient in enumerate(
-                       self.header().x_calibration.polynom_coeff):
-                if power <= self.header().x_calibration.polynom_order:
-                    result += coefficient*(pixel_index**power)
-            line.append(result)
-
-        self._x = line
-        return(line)
+        """
+        Return the calibrated x axis, as an array with one value per pixel.
+        """
+        if self._x is None:
+            self._x = calibration_axis(self.header().x_calibration,
+                                       self.header().xdim)
+
+        return(self._x)
+
+    def y(self):
+        """
+        Return the calibrated y axis, as an array with one value per pixel.
+        """
+        if self._y is None:
+            self._y = calibration_axis(self.header().y_calibration,
+                                       self.header().ydim)
+
+        return(self._y)
                 
     def x_label(self):
         return(self.header().x_calibration.string)
 
+    def y_label(self):
+        return(self.header().y_calibration.string)
+
     def n_frames(self):
         return(self.header().NumFrames)
 
@@ -384,37 +594,107 @@ class Winspec:
         return(self.header().exp_sec)
 
     def to_file(self, filename):
-        # Write the binary structure to file.
-        pass
-
-def flatten(L):
-    for elem in L:
-        if isinstance(elem, collections.Iterable) \
-           and not isinstance(elem, basestring):
-            for sub_elem in flatten(elem):
-                yield(sub_elem)
-        else:
-            yield(elem)
-            
+        """
+        Write the header and frames to a new file.
+        """
+        with open(filename, "wb") as dst_stream:
+            write_winspec(self.data(), dst_stream, header=self.header())
+
+def data_type_index(dtype):
+    """
+    Return the header datatype used to store an array of the given dtype.
+    Bytes and booleans are stored in the nearest wider type, and other floats
+    as float. Integers which a long cannot hold (unsigned long and wider)
+    raise ValueError rather than wrap; convert them first.
+    """
+    dtype = numpy.dtype(dtype)
+    for index, data_type in enumerate(data_types):
+        # Compare regardless of byte order, which is converted on writing.
+        if dtype.newbyteorder(ENDIANNESS) == numpy.dtype(
+                "{0}{1}".format(ENDIANNESS, data_type)):
+            return(index)
+
+    if dtype.kind == "f":
+        return(data_types.index("f"))
+    elif dtype.kind in "bu" and dtype.itemsize == 1:
+        return(data_types.index("H"))
+    elif dtype.kind == "i" and dtype.itemsize == 1:
+        return(data_types.index("h"))
+    elif numpy.can_cast(dtype, numpy.int32):
+        return(data_types.index("i"))
+    else:
+        raise(ValueError("{0} data cannot be stored exactly in a "
+                         "file.".format(dtype)))
+
+def new_header():
+    """
+    Return an empty version 2.x header, with the fields that mark a valid
+    file filled in.
+    """
+    header = cstruct.CStruct(winspec_v2_4_header_t)
+    header.from_buffer(bytes(DATA_OFFSET))
+    header.file_header_ver = 2.5
+    header.WinView_id = 0x01234567
+    header.lastvalue = 0x5555
+    header.noscan = -1
+    header.lnoscan = -1
+    return(header)
+
+def data_header(header, n_frames, height, width, datatype):
+    """
+    Return a copy of header (or a new header, if it is None) describing
+    n_frames frames of height x width pixels of the given datatype.
+    """
+    if header is None:
+        header = new_header()
+    else:
+        header = copy.deepcopy(header)
+
+    header.datatype = datatype
+    header.xdim = width
+    header.ydim = height
+    header.NumFrames = n_frames
+    if not header.xDimDet:
+        header.xDimDet = width
+    if not header.yDimDet:
+        header.yDimDet = height
+
+    return(header)
+
+def write_winspec(data, dst_stream, header=None, datatype=None):
+    """
+    Write data, an array of shape (n_frames, height, width) or a single
+    (height, width) frame, to dst_stream as a version 2.x file. The stream
+    should be positioned at the start of the file.
+
+    The header is a copy of the given header (such as that of the file the
+    data came from) or a new one, with the datatype, dimensions and number of
+    frames set to match the data. The calibrations are kept as given. The
+    pixels are written in one write, in the header datatype (by default the
+    closest one to the dtype of data, see data_type_index).
+    """
+    data = numpy.asarray(data)
+    if data.ndim == 2:
+        data = data[numpy.newaxis]
+    if data.ndim != 3:
+        raise(ValueError("Expected an array of frames, got shape {0}.".format(
+            data.shape)))
+
+    n_frames, height, width = data.shape
+
+    if datatype is None:
+        datatype = data_type_index(data.dtype)
+
+    header = data_header(header, n_frames, height, width, datatype)
+    dtype = numpy.dtype("{0}{1}".format(ENDIANNESS, data_types[datatype]))
+
+    dst_stream.write(header.to_bytes())
+    dst_stream.write(numpy.ascontiguousarray(data, dtype=dtype).data)
 
 def spectrum_to_winspec(spectrum, dst_stream):
-    height = len(spectrum)
-    width = len(spectrum[0])
-
-    for position, form, value in [(6, "h", width),
-                                  (18, "h", height),
-                                  (42, "h", width),
-                                  (108, "h", 1),
-                                  (656, "h", height),
-                                  (1446, "i", 1)]:
-
-        dst_stream.seek(position)
-        if isinstance(value, collections.Iterable):
-            dst_stream.write(struct.pack(form, *value))
-        else:
-            dst_stream.write(struct.pack(form, value))
-
-    dst_stream.seek(4100)
-    dst_stream.write(struct.pack("{0}I".format(height*width),
-                                 *map(int, flatten(spectrum))))
-
+    """
+    Write a single (height, width) frame to dst_stream, as long integers.
+    """
+    write_winspec(numpy.asarray(spectrum).astype(numpy.int32),
+                  dst_stream,
+                  datatype=data_types.index("i"))
@@ -1,2 +1,4 @@
 from .Lightfield import Lightfield
 from .Winspec import Winspec
+from .writer import Writer
+from .detect import open
@@ -0,0 +1,191 @@
+# 
+# Copyright (c) 2011-2014, Thomas Bischof
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without 
+# modification, are permitted provided that the following conditions are met:
+# 
+# 1. Redistributions of source code must retain the above copyright notice, 
+#    this list of conditions and the following disclaimer.
+# 
+# 2. Redistributions in binary form must reproduce the above copyright notice, 
+#    this list of conditions and the following disclaimer in the documentation 
+#    and/or other materials provided with the distribution.
+# 
+# 3. Neither the name of the Massachusetts Institute of Technology nor the 
+#    names of its contributors may be used to endorse or promote products 
+#    derived from this software without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" 
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE 
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE 
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE 
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR 
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF 
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS 
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN 
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) 
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE 
+# POSSIBILITY OF SUCH DAMAGE.
+# 
+
+
+"""
+asyncio counterparts of the readers, for serving many files from an event
+loop. Blocking reads run in a bounded thread pool, and each reader limits the
+number of its reads in flight at once.
+
+    reader = await AsyncWinspec.open(filename)
+    frame = await reader.frame(10)
+    async for frame in reader.frames():
+        ...
+"""
+
+import asyncio
+import concurrent.futures
+import functools
+import os
+import threading
+
+import numpy
+
+from .Lightfield import Lightfield
+from .Winspec import Winspec
+
+_executor = None
+_executor_lock = threading.Lock()
+
+def default_executor():
+    """
+    Return the thread pool shared by readers which are not given one.
+    """
+    global _executor
+
+    with _executor_lock:
+        if _executor is None:
+            _executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers=min(32, (os.cpu_count() or 1) + 4),
+                thread_name_prefix="winspec")
+
+    return(_executor)
+
+class AsyncReader(object):
+    def __init__(self, reader, executor=None, concurrency=4):
+        self._reader = reader
+        self._executor = executor or default_executor()
+        self._semaphore = asyncio.Semaphore(concurrency)
+
+    @classmethod
+    async def open(cls, filename, executor=None, concurrency=4, **kwargs):
+        """
+        Open the file in the executor and read its header.
+        """
+        executor = executor or default_executor()
+        reader = await asyncio.get_running_loop().run_in_executor(
+            executor, functools.partial(cls._open, filename, **kwargs))
+        return(cls(reader, executor=executor, concurrency=concurrency))
+
+    async def _run(self, function, *args):
+        async with self._semaphore:
+            return(await asyncio.get_running_loop().run_in_executor(
+                self._executor, functools.partial(function, *args)))
+
+    async def __aenter__(self):
+        return(self)
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+    async def close(self):
+        await self._run(self._reader.close)
+
+    async def header(self):
+        return(await self._run(self._reader.header))
+
+class AsyncWinspec(AsyncReader):
+    """
+    An asyncio reader of version 2.x files. The data are memory-mapped, and
+    frames are copied out of the map in the executor, so that page faults do
+    not block the event loop.
+    """
+    @staticmethod
+    def _open(filename, **kwargs):
+        kwargs.setdefault("memmap", True)
+        reader = Winspec(filename, **kwargs)
+        return(reader)
+
+    def __len__(self):
+        return(len(self._reader))
+
+    async def frame(self, index):
+        return(await self._run(lambda: numpy.array(self._reader[index])))
+
+    async def data(self):
+        return(await self._run(lambda: numpy.array(self._reader.data())))
+
+    async def frames(self, chunk_frames=16):
+        """
+        Yield each frame in turn, reading chunk_frames frames per call to the
+        executor.
+        """
+        n_frames = len(self._reader)
+        for start in range(0, n_frames, chunk_frames):
+            chunk = await self._run(
+                lambda: numpy.array(
+                    self._reader[start:min(start + chunk_frames, n_frames)]))
+            for frame in chunk:
+                yield(frame)
+
+class AsyncLightfield(AsyncReader):
+    """
+    An asyncio reader of version 3.0 files.
+    """
+    @staticmethod
+    def _open(filename, **kwargs):
+        reader = Lightfield(filename, **kwargs)
+        reader.header()
+        # Read the footer here, so that len() does not block the loop.
+        reader.frame_table()
+        return(reader)
+
+    def __len__(self):
+        return(len(self._reader))
+
+    async def frame(self, index, **kwargs):
+        """
+        Return frame index as a Frame, read in the executor. The keyword
+        arguments (regions, metadata) are passed to Lightfield.frame.
+        """
+        return(await self._run(functools.partial(self._reader.frame,
+                                                 index,
+                                                 **kwargs)))
+
+    async def settings(self):
+        return(await self._run(self._reader.settings))
+
+    async def setting(self, path):
+        settings = await self.settings()
+        return(settings.get(path))
+
+    async def frame_formats(self):
+        return(await self._run(self._reader.frame_formats))
+
+    async def frame_metadata(self):
+        return(await self._run(self._reader.frame_metadata))
+
+    async def frames(self, **kwargs):
+        """
+        Yield each Frame in turn, decoding one per call to the executor. The
+        keyword arguments select frames as for Lightfield.frames.
+        """
+        iterator = self._reader.frames(**kwargs)
+        end = object()
+
+        try:
+            while True:
+                frame = await self._run(next, iterator, end)
+                if frame is end:
+                    return
+                yield(frame)
+        finally:
+            await self._run(iterator.close)
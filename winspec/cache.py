@@ -0,0 +1,275 @@
+# 
+# Copyright (c) 2011-2014, Thomas Bischof
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without 
+# modification, are permitted provided that the following conditions are met:
+# 
+# 1. Redistributions of source code must retain the above copyright notice, 
+#    this list of conditions and the following disclaimer.
+# 
+# 2. Redistributions in binary form must reproduce the above copyright notice, 
+#    this list of conditions and the following disclaimer in the documentation 
+#    and/or other materials provided with the distribution.
+# 
+# 3. Neither the name of the Massachusetts Institute of Technology nor the 
+#    names of its contributors may be used to endorse or promote products 
+#    derived from this software without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" 
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE 
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE 
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE 
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR 
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF 
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS 
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN 
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) 
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE 
+# POSSIBILITY OF SUCH DAMAGE.
+# 
+
+
+"""
+An optional persistent cache of the decoded footers of version 3.0 files (the
+settings and the data formats), stored in an SQLite database. Headers are not
+cached, since reading one is cheaper than looking it up. Entries are keyed by
+the path of the file and are only used while the size and modification time
+of the file are unchanged. The least recently used entries are evicted once
+the cache exceeds its entry or size limit; the access times of hits are
+written in batches.
+
+The cache is disabled by default. Enable it for every reader with
+
+    winspec.cache.configure("/path/to/cache/directory")
+
+or by setting the WINSPEC_CACHE_DIR environment variable, or pass a Cache to
+a reader directly.
+"""
+
+import logging
+import os
+import pickle
+import sqlite3
+import threading
+import time
+
+FILENAME = "winspec-cache.sqlite"
+# The number of hits whose access times are kept in memory before they are
+# written to the database.
+ACCESS_BATCH = 256
+ENVIRONMENT = "WINSPEC_CACHE_DIR"
+
+class Cache(object):
+    """
+    A cache of pickled values in an SQLite database in directory. The values
+    are produced by this package from files the user chose to read, and the
+    cache should live in a directory only that user can write to.
+    """
+    def __init__(self,
+                 directory,
+                 max_entries=100000,
+                 max_bytes=1 << 30):
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        self.filename = os.path.join(directory, FILENAME)
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+
+        self._lock = threading.Lock()
+        self._accessed = dict()
+        self._connection = sqlite3.connect(self.filename,
+                                           timeout=30,
+                                           check_same_thread=False)
+        with self._lock, self._connection:
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                "path TEXT NOT NULL, "
+                "kind TEXT NOT NULL, "
+                "size INTEGER NOT NULL, "
+                "mtime INTEGER NOT NULL, "
+                "value BLOB NOT NULL, "
+                "nbytes INTEGER NOT NULL, "
+                "accessed REAL NOT NULL, "
+                "PRIMARY KEY (path, kind))")
+            self._connection.execute(
+                "CREATE INDEX IF NOT EXISTS entries_accessed "
+                "ON entries (accessed)")
+
+    def close(self):
+        with self._lock:
+            with self._connection:
+                self._write_accessed()
+            self._connection.close()
+
+    def _write_accessed(self):
+        """
+        Write the pending access times of hits, which are kept in memory so
+        that a hit does not write to the database. The lock must be held,
+        inside a transaction.
+        """
+        if self._accessed:
+            self._connection.executemany(
+                "UPDATE entries SET accessed = ? WHERE path = ? AND kind = ?",
+                [(accessed, path, kind)
+                 for (path, kind), accessed in self._accessed.items()])
+            self._accessed.clear()
+
+    def get(self, path, kind, status=None):
+        """
+        Return the value stored for the file and kind, or None if there is
+        none or the file has changed since it was stored. status is the
+        os.stat of the file, if it has already been taken.
+        """
+        path = os.path.abspath(path)
+        if status is None:
+            try:
+                status = os.stat(path)
+            except OSError:
+                return(None)
+
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT value FROM entries "
+                "WHERE path = ? AND kind = ? AND size = ? AND mtime = ?",
+                (path, kind, status.st_size, status.st_mtime_ns)).fetchone()
+
+            if row is None:
+                return(None)
+
+            self._accessed[(path, kind)] = time.time()
+            if len(self._accessed) >= ACCESS_BATCH:
+                with self._connection:
+                    self._write_accessed()
+
+        try:
+            return(pickle.loads(row[0]))
+        except Exception:
+            logging.warning("Discarding unreadable cache entry {0} "
+                            "for {1}.".format(kind, path))
+            return(None)
+
+    def put(self, path, kind, value, status=None):
+        """
+        Store the value for the file and kind, replacing any older entry, and
+        evict entries if the cache is over its limits. status is the os.stat
+        of the file the value was computed from; by default it is taken now.
+        """
+        path = os.path.abspath(path)
+        if status is None:
+            try:
+                status = os.stat(path)
+            except OSError:
+                return
+
+        data = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+
+        with self._lock, self._connection:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO entries "
+                "(path, kind, size, mtime, value, nbytes, accessed) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (path, kind, status.st_size, status.st_mtime_ns,
+                 sqlite3.Binary(data), len(data), time.time()))
+            self._write_accessed()
+            self._evict()
+
+    def _evict(self):
+        n_entries, n_bytes = self._connection.execute(
+            "SELECT COUNT(*), COALESCE(SUM(nbytes), 0) FROM entries"
+            ).fetchone()
+
+        if n_entries <= self.max_entries and n_bytes <= self.max_bytes:
+            return
+
+        evicted = list()
+        for rowid, nbytes in self._connection.execute(
+                "SELECT rowid, nbytes FROM entries ORDER BY accessed"):
+            if n_entries <= self.max_entries and n_bytes <= self.max_bytes:
+                break
+            evicted.append((rowid,))
+            n_entries -= 1
+            n_bytes -= nbytes
+
+        self._connection.executemany("DELETE FROM entries WHERE rowid = ?",
+                                     evicted)
+
+    def clear(self):
+        with self._lock, self._connection:
+            self._connection.execute("DELETE FROM entries")
+
+    def lookup(self, path, kind, compute):
+        """
+        Return the cached value for the file and kind, calling compute and
+        storing its result if there is none. The file is looked at once,
+        before compute, and the result is stored under that size and
+        modification time. If the file changes while compute runs, the entry
+        is therefore already stale, rather than holding an old value under
+        the new times.
+        """
+        try:
+            status = os.stat(path)
+        except OSError:
+            return(compute())
+
+        value = self.get(path, kind, status=status)
+        if value is None:
+            value = compute()
+            self.put(path, kind, value, status=status)
+
+        return(value)
+
+_default = None
+_default_lock = threading.Lock()
+
+def configure(directory=None, **kwargs):
+    """
+    Set the cache used by readers which are not given one. With no
+    directory, the cache is disabled.
+    """
+    global _default
+
+    with _default_lock:
+        if directory is None:
+            _default = False
+        else:
+            _default = Cache(directory, **kwargs)
+
+    return(_default or None)
+
+def default():
+    """
+    Return the cache used by readers which are not given one, or None if
+    caching is disabled. Unless configure has been called, this is a cache in
+    the directory named by the WINSPEC_CACHE_DIR environment variable, if set.
+    """
+    global _default
+
+    with _default_lock:
+        if _default is None:
+            directory = os.environ.get(ENVIRONMENT)
+            _default = Cache(directory) if directory else False
+
+    return(_default or None)
+
+def resolve(cache):
+    """
+    Return the cache for a reader given its cache argument: the one set by
+    configure (or the environment) for None, none for False, or the Cache
+    given.
+    """
+    if cache is None:
+        return(default())
+    else:
+        return(cache or None)
+
+def lookup(cache, path, kind, compute):
+    """
+    Return the value for the file and kind through the cache, or simply
+    compute it if cache is None.
+    """
+    if cache is None:
+        return(compute())
+    else:
+        return(cache.lookup(path, kind, compute))
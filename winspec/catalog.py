@@ -0,0 +1,170 @@
+# 
+# Copyright (c) 2011-2014, Thomas Bischof
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without 
+# modification, are permitted provided that the following conditions are met:
+# 
+# 1. Redistributions of source code must retain the above copyright notice, 
+#    this list of conditions and the following disclaimer.
+# 
+# 2. Redistributions in binary form must reproduce the above copyright notice, 
+#    this list of conditions and the following disclaimer in the documentation 
+#    and/or other materials provided with the distribution.
+# 
+# 3. Neither the name of the Massachusetts Institute of Technology nor the 
+#    names of its contributors may be used to endorse or promote products 
+#    derived from this software without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" 
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE 
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE 
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE 
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR 
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF 
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS 
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN 
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) 
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE 
+# POSSIBILITY OF SUCH DAMAGE.
+# 
+
+
+"""
+Build a flat table of header fields and key footer settings for every SPE file
+under a directory, reading only the 4100-byte header (and the XML footer for
+version 3.0 files) of each, in a pool of worker processes.
+
+    python -m winspec.catalog /path/to/archive -o catalog.csv
+"""
+
+import argparse
+import concurrent.futures
+import csv
+import logging
+import os
+import sys
+import time
+
+from . import cstruct
+from .Lightfield import Lightfield
+from .Winspec import DATA_OFFSET, winspec_v2_4_header_t
+
+HEADER_FIELDS = [name
+                 for name, (number, formtype) in winspec_v2_4_header_t
+                 if isinstance(formtype, str)
+                 and (number == 1 or formtype not in cstruct.NUMERIC)
+                 and not name.startswith("Spare")]
+
+FOOTER_SETTINGS = ["exposure_time",
+                   "gain",
+                   "ad_rate",
+                   "frame_rate",
+                   "temperature_set",
+                   "temperature_read",
+                   "readout_time",
+                   "frames_per_readout",
+                   "background_file"]
+
+COLUMNS = ["path", "size", "version", "error"] \
+          + HEADER_FIELDS + FOOTER_SETTINGS
+
+def find_files(root, extensions=(".spe",)):
+    """
+    Yield the path of each file under root with one of the extensions,
+    compared case-insensitively.
+    """
+    for directory, subdirectories, filenames in os.walk(root):
+        subdirectories.sort()
+        for filename in sorted(filenames):
+            if os.path.splitext(filename)[1].lower() in extensions:
+                yield(os.path.join(directory, filename))
+
+def scan_file(path):
+    """
+    Return a dictionary of the header fields of the file and, for version 3.0
+    files, the footer settings. Errors are reported in the "error" column
+    rather than raised, so that one bad file does not stop a scan.
+    """
+    row = {"path": path}
+
+    try:
+        with open(path, "rb") as data_file:
+            row["size"] = os.fstat(data_file.fileno()).st_size
+            data = data_file.read(DATA_OFFSET)
+
+        header = cstruct.CStruct(winspec_v2_4_header_t)
+        header.from_buffer(data)
+
+        for name in HEADER_FIELDS:
+            row[name] = getattr(header, name)
+
+        row["version"] = header.file_header_ver
+
+        if header.file_header_ver >= 3:
+            with Lightfield(path, header_data=data) as lightfield:
+                for name in FOOTER_SETTINGS:
+                    row[name] = getattr(lightfield, name)()
+    except Exception as error:
+        row["error"] = "{0}: {1}".format(type(error).__name__, error)
+
+    return(row)
+
+def scan(root, processes=None, chunksize=64):
+    """
+    Scan every SPE file under root in a pool of processes, yielding one row
+    per file (see scan_file) in directory order.
+    """
+    paths = find_files(root)
+
+    if processes == 1:
+        for path in paths:
+            yield(scan_file(path))
+    else:
+        with concurrent.futures.ProcessPoolExecutor(processes) as pool:
+            for row in pool.map(scan_file, paths, chunksize=chunksize):
+                yield(row)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Catalog the headers of the SPE files in a directory.")
+    parser.add_argument("root",
+                        help="Directory to scan.")
+    parser.add_argument("-o", "--output",
+                        help="CSV file to write (default: standard output).")
+    parser.add_argument("-p", "--processes", type=int, default=None,
+                        help="Number of worker processes "
+                        "(default: one per CPU).")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+
+    if args.output:
+        output = open(args.output, "w", newline="")
+    else:
+        output = sys.stdout
+
+    try:
+        writer = csv.DictWriter(output, COLUMNS)
+        writer.writeheader()
+
+        start = time.time()
+        n_files = 0
+        n_bytes = 0
+        for row in scan(args.root, processes=args.processes):
+            writer.writerow(row)
+            n_files += 1
+            n_bytes += row.get("size", 0)
+        elapsed = max(time.time() - start, 1e-9)
+    finally:
+        if output is not sys.stdout:
+            output.close()
+
+    logging.info("Scanned {0} files ({1:.1f} MB) in {2:.2f} s: "
+                 "{3:.1f} files/s.".format(n_files,
+                                           n_bytes/1e6,
+                                           elapsed,
+                                           n_files/elapsed))
+
+if __name__ == "__main__":
+    main()
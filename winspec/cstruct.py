@@ -33,6 +33,136 @@ import struct
 import logging
 import pprint
 
+# Field kinds used by the compiled layouts.
+SCALAR = 0
+ARRAY = 1
+STRING = 2
+STRUCT = 3
+STRUCTS = 4
+
+NUMERIC = "?bBhHiIlLqQfdP"
+ENDIANNESS = "<"
+# Char arrays are decoded byte for byte, so that any bytes round-trip.
+STRING_ENCODING = "latin-1"
+
+class Layout(object):
+    """
+    A structure definition compiled to a single flat struct.Struct, along with
+    the plan used to rebuild the named fields from the unpacked values.
+    """
+    def __init__(self, definition):
+        self.definition = definition
+        codes = list()
+        self.plan = compile_plan(definition, codes)
+        self.codec = struct.Struct(ENDIANNESS + "".join(codes))
+        self.size = self.codec.size
+
+    def unpack(self, buffer, offset=0):
+        return(self.codec.unpack_from(buffer, offset))
+
+    def pack(self, target):
+        values = list()
+        collect(target, self.plan, values)
+        return(self.codec.pack(*values))
+
+_layouts = dict()
+
+def layout(definition):
+    """
+    Return the compiled layout of the definition, building it on first use.
+    The definition itself is kept alongside the layout so that its id cannot
+    be reused while the cache entry exists.
+    """
+    try:
+        return(_layouts[id(definition)][1])
+    except KeyError:
+        result = Layout(definition)
+        _layouts[id(definition)] = (definition, result)
+        return(result)
+
+def compile_plan(definition, codes):
+    """
+    Append the struct codes for each field of the definition to codes, and
+    return a list of (name, kind, index, number, subdefinition, subplan) where
+    index is the position of the field in the flat unpacked tuple.
+    """
+    plan = list()
+
+    for name, form in definition:
+        number, formtype = form
+
+        if isinstance(formtype, str):
+            index = len(codes)
+            if formtype in NUMERIC:
+                codes.extend([formtype]*number)
+                if number == 1:
+                    plan.append((name, SCALAR, index, number, None, None))
+                else:
+                    plan.append((name, ARRAY, index, number, None, None))
+            else:
+                # Character arrays are read as a single bytes object.
+                codes.append("{0}s".format(number))
+                plan.append((name, STRING, index, number, None, None))
+        elif number == 1:
+            plan.append((name, STRUCT, None, number, formtype,
+                         compile_plan(formtype, codes)))
+        else:
+            plan.append((name, STRUCTS, None, number, formtype,
+                         [compile_plan(formtype, codes)
+                          for i in range(number)]))
+
+    return(plan)
+
+def populate(target, plan, values):
+    """
+    Set the attributes of target from the flat tuple of unpacked values.
+    """
+    for name, kind, index, number, subdefinition, subplan in plan:
+        if kind == SCALAR:
+            value = values[index]
+        elif kind == ARRAY:
+            value = list(values[index:index+number])
+        elif kind == STRING:
+            value = strip_null(values[index].decode(STRING_ENCODING))
+        elif kind == STRUCT:
+            value = CStruct(subdefinition)
+            populate(value, subplan, values)
+        else:
+            value = tuple([CStruct(subdefinition) for i in range(number)])
+            for element, element_plan in zip(value, subplan):
+                populate(element, element_plan, values)
+
+        setattr(target, name, value)
+
+def collect(target, plan, values):
+    """
+    The inverse of populate: append the values of the fields of target to
+    values, in layout order. Missing fields are written as zeros, and arrays
+    and strings are padded with zeros to their full length.
+    """
+    for name, kind, index, number, subdefinition, subplan in plan:
+        value = getattr(target, name, None)
+
+        if kind == SCALAR:
+            values.append(0 if value is None else value)
+        elif kind == ARRAY:
+            value = list(value or [])[:number]
+            values.extend(value + [0]*(number - len(value)))
+        elif kind == STRING:
+            values.append((value or "").encode(STRING_ENCODING))
+        elif kind == STRUCT:
+            if value is None:
+                value = CStruct(subdefinition)
+            collect(value, subplan, values)
+        else:
+            value = value or ()
+            for element_index, element_plan in enumerate(subplan):
+                if element_index < len(value):
+                    element = value[element_index]
+                else:
+                    element = CStruct(subdefinition)
+                collect(element, element_plan, values)
+
 class CStruct(object):
     def __init__(self, definition):
         self.__definition = definition
@@ -48,6 +178,26 @@ class CStruct(object):
     def from_stream(self, data):
         stream_to_tuple(data, self.__definition, self)
 
+    def from_buffer(self, buffer, offset=0):
+        """
+        Populate the structure from a bytes-like object, starting at offset.
+        """
+        my_layout = layout(self.__definition)
+        populate(self, my_layout.plan, my_layout.unpack(buffer, offset))
+
+    def size(self):
+        return(layout(self.__definition).size)
+
+    def to_bytes(self):
+        """
+        Return the packed binary form of the structure, as read by
+        from_stream.
+        """
+        return(layout(self.__definition).pack(self))
+
+    def to_stream(self, data):
+        data.write(self.to_bytes())
+
     def to_list(self):
         result = list()
         for name, form in self.__definition:
@@ -79,63 +229,21 @@ def add_tab(string, tabs=1):
     return(result)
 
 def strip_null(string):
-    return(string.rstrip("\x000").lstrip("\x000"))
+    """
+    Strip the null padding from the end of a char array. Anything else,
+    including bytes after an embedded null, is kept, so that packing the
+    string again gives back the same bytes.
+    """
+    return(string.rstrip("\x00"))
 
 def stream_to_tuple(data, structure_definition, target):
-    """Given the structure of interest, populates the named tuple with the
-appropriate data. Ideally, this could be done with tuple._make(struct.unpack())),
-but strings do not seem to work properly in this case."""
-    for index, definition in enumerate(structure_definition):
-        logging.debug(definition)
-        name, form = definition
-        number, formtype = form
-        logging.debug("{0}: {1}".format(name, form))
-
-        if type(formtype) == type(str()):
-            # We have a string format, so no recursion
-            formstr = "{0}{1}".format(number, formtype)
-            logging.debug("Reading {0} ({1}) from stream at offset {2}.".format(
-                name, formstr, data.tell()))
-
-            size = struct.calcsize(formstr)
-            my_data = data.read(size)
-            value = struct.unpack_from(formstr, my_data)
-
-            logging.debug("Found: {0}".format(value))
-
-            # Now that we have the data, we need to consider whether it is an
-            # array or a single value. If a character array, create a string.
-            # If a numerical array, make a list. If a single value, make a
-            # single value
-            if form[-1] in "?bBhHiIlLqQfdP":
-                logging.debug("Numerical value.")
-                # Numerical value
-                if form[0] == 1:
-                    # Single value
-                    value = value[0]
-                else:
-                    value = list(value)
-            else:
-                # Character value
-                # Kludge to get rid of "\x00". This should be possible using nicer
-                # methods.
-                logging.debug("Character value.")
-                value = strip_null(bytes("".encode()).join(value).decode())
-
-            logging.debug("{0}: {1}".format(name, value))
-                
-            setattr(target, name, value)
-        else:
-            # Recursion!
-            logging.debug("Recursing!")
-            if number == 1:
-                setattr(target, name, CStruct(formtype))
-                stream_to_tuple(data, formtype, getattr(target, name))
-            else:
-                setattr(target, name, tuple([CStruct(formtype)
-                                             for i in range(number)]))
-                for i in range(number):
-                    stream_to_tuple(data, formtype, getattr(target, name)[i])
+    """Given the structure of interest, populates the target with the
+appropriate data. The definition is compiled once to a single struct layout, so
+the whole structure (including nested structures) is read and unpacked in one
+pass."""
+    my_layout = layout(structure_definition)
+    my_data = data.read(my_layout.size)
+    populate(target, my_layout.plan, my_layout.unpack(my_data))
 
 if __name__ == "__main__":
     logging.basicConfig(level=logging.DEBUG)
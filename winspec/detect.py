@@ -0,0 +1,104 @@
+# 
+# Copyright (c) 2011-2014, Thomas Bischof
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without 
+# modification, are permitted provided that the following conditions are met:
+# 
+# 1. Redistributions of source code must retain the above copyright notice, 
+#    this list of conditions and the following disclaimer.
+# 
+# 2. Redistributions in binary form must reproduce the above copyright notice, 
+#    this list of conditions and the following disclaimer in the documentation 
+#    and/or other materials provided with the distribution.
+# 
+# 3. Neither the name of the Massachusetts Institute of Technology nor the 
+#    names of its contributors may be used to endorse or promote products 
+#    derived from this software without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" 
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE 
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE 
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE 
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR 
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF 
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS 
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN 
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) 
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE 
+# POSSIBILITY OF SUCH DAMAGE.
+# 
+
+
+
+"""
+Open an SPE file without knowing its version beforehand:
+
+    reader = winspec.open(filename)
+
+The 4100-byte header block is read once, and handed to the reader for the
+version found in it, which does not read it again.
+"""
+
+import io
+import logging
+import struct
+
+from .Lightfield import Lightfield
+from .Winspec import DATA_OFFSET, ENDIANNESS, Winspec
+
+FILE_HEADER_VER = (1992, "f")
+WINVIEW_ID = (2996, "i")
+LASTVALUE = (4098, "h")
+
+WINVIEW_ID_VALUE = 0x01234567
+LASTVALUE_VALUE = 0x5555
+
+def read_field(data, field):
+    offset, my_type = field
+    return(struct.unpack_from("{0}{1}".format(ENDIANNESS, my_type),
+                              data,
+                              offset)[0])
+
+def file_version(data):
+    """
+    Return the file_header_ver of a header block.
+    """
+    return(read_field(data, FILE_HEADER_VER))
+
+def reader_class(data):
+    """
+    Return the reader class for a header block: Lightfield for version 3.0
+    and later, Winspec otherwise. A block too short to be a header raises
+    ValueError. Files without the WinView_id and lastvalue markers are still
+    read as version 2.x files, with a warning.
+    """
+    if len(data) < DATA_OFFSET:
+        raise(ValueError("Expected a {0}-byte header, found {1} bytes.".format(
+            DATA_OFFSET, len(data))))
+
+    if file_version(data) >= 3:
+        return(Lightfield)
+
+    if read_field(data, WINVIEW_ID) != WINVIEW_ID_VALUE \
+       and read_field(data, LASTVALUE) != LASTVALUE_VALUE:
+        logging.warning("The header has neither the WinView_id nor the "
+                        "lastvalue marker; reading it as version 2.x.")
+
+    return(Winspec)
+
+def open(filename, **kwargs):
+    """
+    Return a Winspec or Lightfield reader for the file, according to the
+    version in its header, which is read in one read. The keyword arguments
+    are passed to the reader.
+    """
+    with io.open(filename, "rb") as data_file:
+        data = data_file.read(DATA_OFFSET)
+
+    reader = reader_class(data)(filename, header_data=data, **kwargs)
+
+    if reader.stats is not None:
+        reader.stats.read(len(data))
+
+    return(reader)
@@ -0,0 +1,106 @@
+# 
+# Copyright (c) 2011-2014, Thomas Bischof
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without 
+# modification, are permitted provided that the following conditions are met:
+# 
+# 1. Redistributions of source code must retain the above copyright notice, 
+#    this list of conditions and the following disclaimer.
+# 
+# 2. Redistributions in binary form must reproduce the above copyright notice, 
+#    this list of conditions and the following disclaimer in the documentation 
+#    and/or other materials provided with the distribution.
+# 
+# 3. Neither the name of the Massachusetts Institute of Technology nor the 
+#    names of its contributors may be used to endorse or promote products 
+#    derived from this software without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" 
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE 
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE 
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE 
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR 
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF 
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS 
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN 
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) 
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE 
+# POSSIBILITY OF SUCH DAMAGE.
+# 
+
+
+"""
+Follow SPE files which are still being written, yielding each frame once it
+is complete, in the manner of tail -f.
+"""
+
+import os
+import time
+
+import numpy
+
+def follow(filename,
+           shape,
+           dtype,
+           offset,
+           stride=None,
+           end=None,
+           interval=0.1,
+           timeout=None,
+           chunk_frames=64):
+    """
+    Yield each frame of the file as an array of the given (height, width)
+    shape and dtype, as soon as it is completely written. Frames start at
+    offset and are stride bytes apart (by default, the size of a frame).
+
+    The file is polled every interval seconds with a stat, and only the
+    new frames are read, at most chunk_frames at a time. If end is given, it
+    is called with the open file on each poll and returns the offset at
+    which the frame data end, or None while the file is still growing.
+    Iteration stops once all frames before that offset are yielded, or once
+    no frame has arrived for timeout seconds.
+    """
+    dtype = numpy.dtype(dtype)
+    height, width = shape
+    frame_bytes = height*width*dtype.itemsize
+    if stride is None:
+        stride = frame_bytes
+
+    position = offset
+    last_frame = time.time()
+
+    # Unbuffered, so that every poll sees what is on disk now rather than a
+    # stale buffer.
+    with open(filename, "rb", buffering=0) as data_file:
+        while True:
+            size = os.fstat(data_file.fileno()).st_size
+            data_end = end(data_file) if end else None
+            if data_end:
+                size = min(size, data_end)
+
+            n_frames = min(max(size - position, 0) // stride, chunk_frames)
+
+            if n_frames:
+                data = bytearray(n_frames*stride)
+                data_file.seek(position)
+                n_frames = data_file.readinto(data) // stride
+
+                frames = numpy.frombuffer(data,
+                                          dtype=numpy.uint8,
+                                          count=n_frames*stride)
+                frames = frames.reshape(n_frames, stride)[:, :frame_bytes]
+                frames = numpy.ascontiguousarray(frames).view(dtype).reshape(
+                    n_frames, height, width)
+
+                for frame in frames:
+                    yield(frame)
+
+                position += n_frames*stride
+                last_frame = time.time()
+            elif data_end and size - position < stride:
+                return
+            elif timeout is not None and time.time() - last_frame > timeout:
+                return
+            else:
+                time.sleep(interval)
@@ -0,0 +1,290 @@
+# 
+# Copyright (c) 2011-2014, Thomas Bischof
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without 
+# modification, are permitted provided that the following conditions are met:
+# 
+# 1. Redistributions of source code must retain the above copyright notice, 
+#    this list of conditions and the following disclaimer.
+# 
+# 2. Redistributions in binary form must reproduce the above copyright notice, 
+#    this list of conditions and the following disclaimer in the documentation 
+#    and/or other materials provided with the distribution.
+# 
+# 3. Neither the name of the Massachusetts Institute of Technology nor the 
+#    names of its contributors may be used to endorse or promote products 
+#    derived from this software without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" 
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE 
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE 
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE 
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR 
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF 
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS 
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN 
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) 
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE 
+# POSSIBILITY OF SUCH DAMAGE.
+# 
+
+
+
+"""
+An optional process-wide pool of open file handles, shared by the readers.
+Repeated reads of a file reuse its handle instead of opening it again, and
+the least recently used handles are closed once the pool holds more than
+max_handles of them, so that batch jobs over many files stay within the
+limit on open file descriptors.
+
+The pool is disabled by default, and each reader keeps its own handle until
+it is closed. Enable it for every reader with
+
+    winspec.handles.configure(max_handles=256)
+
+or by setting the WINSPEC_MAX_HANDLES environment variable, or pass a
+HandlePool to a reader directly.
+
+Handles are keyed by the absolute path of the file, so a file replaced on
+disk is read through its old handle until that is evicted or discarded.
+"""
+
+import collections
+import contextlib
+import os
+import threading
+
+from . import cache as cache_module
+
+ENVIRONMENT = "WINSPEC_MAX_HANDLES"
+
+# Where there are no positioned reads, they are emulated with seek and
+# read under this lock.
+_seek_lock = threading.Lock()
+
+def read_into(data_file, offset, buffer):
+    """
+    Fill buffer with the bytes of the file from offset on, without using or
+    moving the position of the handle, so that threads may share it. Return
+    the number of bytes read, which is short only at the end of the file.
+    """
+    view = memoryview(buffer).cast("B")
+    n_bytes = 0
+
+    while n_bytes < len(view):
+        if hasattr(os, "preadv"):
+            n_read = os.preadv(data_file.fileno(),
+                               [view[n_bytes:]],
+                               offset + n_bytes)
+        else:
+            with _seek_lock:
+                data_file.seek(offset + n_bytes)
+                n_read = data_file.readinto(view[n_bytes:])
+
+        if not n_read:
+            break
+        n_bytes += n_read
+
+    return(n_bytes)
+
+def read_at(data_file, offset, size=None):
+    """
+    Return size bytes of the file from offset on (or all of the rest of the
+    file), read as by read_into.
+    """
+    if size is None:
+        size = max(os.fstat(data_file.fileno()).st_size - offset, 0)
+
+    buffer = bytearray(size)
+    del buffer[read_into(data_file, offset, buffer):]
+    return(bytes(buffer))
+
+class HandlePool(object):
+    """
+    A pool of at most max_handles open binary file handles, keyed by path.
+    A handle in use is never closed; if the pool is over its limit while
+    every handle is in use, the oldest is closed once it is released.
+    """
+    def __init__(self, max_handles=128):
+        self.max_handles = max_handles
+        self._handles = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def handle(self, filename):
+        """
+        Lend out the open handle of filename for the body of the with
+        statement, opening it if the pool does not hold one.
+        """
+        key = os.path.abspath(filename)
+
+        with self._lock:
+            entry = self._handles.get(key)
+            if entry is None:
+                entry = [open(filename, "rb"), 0]
+                self._handles[key] = entry
+            else:
+                self._handles.move_to_end(key)
+
+            entry[1] += 1
+            self._evict()
+
+        try:
+            yield(entry[0])
+        finally:
+            with self._lock:
+                entry[1] -= 1
+                if self._handles.get(key) is not entry:
+                    # Discarded while in use.
+                    if not entry[1]:
+                        entry[0].close()
+                else:
+                    self._evict()
+
+    def _evict(self):
+        """
+        Close the least recently used handles not in use until the pool is
+        within its limit. The lock must be held.
+        """
+        excess = len(self._handles) - self.max_handles
+        if excess <= 0:
+            return
+
+        for key, entry in list(self._handles.items()):
+            if not entry[1]:
+                del self._handles[key]
+                entry[0].close()
+                excess -= 1
+                if not excess:
+                    break
+
+    def discard(self, filename):
+        """
+        Close the handle of filename, if the pool holds one.
+        """
+        with self._lock:
+            entry = self._handles.pop(os.path.abspath(filename), None)
+            if entry is not None and not entry[1]:
+                entry[0].close()
+
+    def close(self):
+        """
+        Close every handle in the pool.
+        """
+        with self._lock:
+            keys = list(self._handles)
+
+        for key in keys:
+            self.discard(key)
+
+_default = None
+_default_lock = threading.Lock()
+
+def configure(max_handles=None):
+    """
+    Set the pool used by readers which are not given one. With no
+    max_handles, the pool is disabled.
+    """
+    global _default
+
+    with _default_lock:
+        if _default:
+            _default.close()
+
+        if max_handles is None:
+            _default = False
+        else:
+            _default = HandlePool(max_handles)
+
+    return(_default or None)
+
+def default():
+    """
+    Return the pool used by readers which are not given one, or None if
+    pooling is disabled. Unless configure has been called, this is a pool
+    limited to WINSPEC_MAX_HANDLES handles, if that environment variable is
+    set.
+    """
+    global _default
+
+    with _default_lock:
+        if _default is None:
+            max_handles = os.environ.get(ENVIRONMENT)
+            _default = HandlePool(int(max_handles)) if max_handles else False
+
+    return(_default or None)
+
+def resolve(handles):
+    """
+    Return the pool for a reader given its handles argument: the one set by
+    configure (or the environment) for None, none for False, or the
+    HandlePool given.
+    """
+    if handles is None:
+        return(default())
+    else:
+        return(handles or None)
+
+class FileReader(object):
+    """
+    The file handle and lifecycle shared by the readers. A reader reads
+    through a handle lent out by its pool, or, without one, through its own
+    handle, opened on first use and kept until close(). Readers can be used
+    in a with statement, and cannot read from the file once closed.
+    """
+    def _open_file(self, filename, cache=None, handles=None):
+        """
+        Set up the cache and file handles for reading filename. None for
+        either means the process-wide one, and False none at all.
+        """
+        self._path = filename
+        self._cache = cache_module.resolve(cache)
+        self._handles = resolve(handles)
+        self._data_file = None
+        self._lock = threading.Lock()
+        self._closed = False
+
+    def __enter__(self):
+        return(self)
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        """
+        Close the file handle of the reader (a pooled handle is left to the
+        pool) and release anything mapped from the file.
+        """
+        with self._lock:
+            self._closed = True
+            if self._data_file is not None:
+                self._data_file.close()
+                self._data_file = None
+
+        self._release()
+
+    def _release(self):
+        """
+        Drop the data mapped or read from the file, on closing.
+        """
+        pass
+
+    def _check_open(self):
+        if self._closed:
+            raise(ValueError("I/O operation on a closed reader."))
+
+    def _handle(self):
+        """
+        Return a context manager lending out an open handle of the file.
+        """
+        self._check_open()
+
+        if self._handles is not None:
+            return(self._handles.handle(self._path))
+
+        with self._lock:
+            if self._data_file is None:
+                self._data_file = open(self._path, "rb")
+
+        return(contextlib.nullcontext(self._data_file))
@@ -0,0 +1,178 @@
+# 
+# Copyright (c) 2011-2014, Thomas Bischof
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without 
+# modification, are permitted provided that the following conditions are met:
+# 
+# 1. Redistributions of source code must retain the above copyright notice, 
+#    this list of conditions and the following disclaimer.
+# 
+# 2. Redistributions in binary form must reproduce the above copyright notice, 
+#    this list of conditions and the following disclaimer in the documentation 
+#    and/or other materials provided with the distribution.
+# 
+# 3. Neither the name of the Massachusetts Institute of Technology nor the 
+#    names of its contributors may be used to endorse or promote products 
+#    derived from this software without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" 
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE 
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE 
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE 
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR 
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF 
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS 
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN 
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) 
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE 
+# POSSIBILITY OF SUCH DAMAGE.
+# 
+
+
+"""
+Decode the frames of large files in a pool of worker processes. The frames of
+a file have a fixed size and stride, so the frame range is split into chunks
+of whole frames by byte offset; each worker reads and decodes its chunks
+independently, optionally applying a conversion, and the results are
+assembled in frame order.
+
+    frames = decode(Winspec(filename), processes=32, convert=correct)
+"""
+
+import collections
+import concurrent.futures
+import os
+
+import numpy
+
+from .Lightfield import DATA_OFFSET
+from .handles import read_into
+
+# The most bytes of file read (and returned to the parent) per chunk, unless
+# the chunk size is given.
+CHUNK_BYTES = 64 << 20
+
+FrameLayout = collections.namedtuple("FrameLayout",
+                                     ["filename",
+                                      "offset",
+                                      "count",
+                                      "stride",
+                                      "frame_offset",
+                                      "dtype",
+                                      "shape"])
+
+def frame_layouts(reader, region=0, block=None):
+    """
+    Return the FrameLayout of each run of frames in the file: for a
+    Winspec, the data section, and for a Lightfield, the given region of
+    each data block (or only of the given block).
+    """
+    if hasattr(reader, "data_blocks"):
+        layouts = list()
+        offset = DATA_OFFSET
+
+        for index, data_block in enumerate(
+                [frame_format
+                 for data_format in reader.frame_formats()
+                 for frame_format in data_format]):
+            if block is None or index == block:
+                region_format = data_block.regions[region]
+                layouts.append(FrameLayout(
+                    reader.filename,
+                    offset,
+                    data_block.count,
+                    data_block.stride,
+                    data_block.region_offsets[region],
+                    data_block.pixel_format,
+                    (region_format.height, region_format.width)))
+
+            offset += data_block.count*data_block.stride
+
+        return(layouts)
+    else:
+        return([FrameLayout(reader._filename,
+                            DATA_OFFSET,
+                            reader.n_frames(),
+                            reader.frame_bytes(),
+                            0,
+                            reader.data_type(),
+                            (reader.frame_height(), reader.frame_width()))])
+
+def decode_chunk(layout, start, stop, convert=None):
+    """
+    Read and decode frames start to stop of the layout.
+    """
+    n_frames = stop - start
+    frame_bytes = layout.dtype.itemsize*layout.shape[0]*layout.shape[1]
+    data = bytearray(n_frames*layout.stride)
+
+    with open(layout.filename, "rb", buffering=0) as data_file:
+        # A single read returns at most about 2 GiB, so read in a loop.
+        if read_into(data_file,
+                     layout.offset + start*layout.stride,
+                     data) != len(data):
+            raise(IOError("Frames {0} to {1} of {2} are truncated.".format(
+                start, stop, layout.filename)))
+
+    frames = numpy.frombuffer(data, dtype=numpy.uint8).reshape(
+        n_frames, layout.stride)
+    frames = frames[:, layout.frame_offset:layout.frame_offset + frame_bytes]
+    frames = numpy.ascontiguousarray(frames).view(layout.dtype).reshape(
+        (n_frames,) + layout.shape)
+
+    if convert is not None:
+        frames = convert(frames)
+
+    return(frames)
+
+def decode(reader,
+           processes=None,
+           chunk_frames=None,
+           convert=None,
+           dtype=None,
+           region=0,
+           block=None):
+    """
+    Decode every frame of a Winspec or Lightfield (see frame_layouts) into
+    an array of shape (n_frames, height, width), splitting the work across
+    processes worker processes.
+
+    convert, if given, is applied to each chunk of frames in the workers; it
+    must be picklable (a module-level function) and preserve the shape. The
+    result has the given dtype, by default that of the file. By default each
+    worker gets about four chunks, of at most CHUNK_BYTES bytes each.
+    """
+    layouts = frame_layouts(reader, region, block)
+    shapes = set(layout.shape for layout in layouts)
+    if len(shapes) != 1:
+        raise(ValueError("The data blocks have different frame shapes: "
+                         "{0}.".format(sorted(shapes))))
+
+    n_frames = sum(layout.count for layout in layouts)
+    result = numpy.empty((n_frames,) + layouts[0].shape,
+                         dtype=dtype or layouts[0].dtype)
+
+    if chunk_frames is None:
+        workers = processes or os.cpu_count() or 1
+        chunk_frames = max(1, -(-n_frames // (4*workers)))
+        stride = max(layout.stride for layout in layouts)
+        chunk_frames = min(chunk_frames, max(1, CHUNK_BYTES // stride))
+
+    tasks = list()
+    index = 0
+    for layout in layouts:
+        for start in range(0, layout.count, chunk_frames):
+            stop = min(start + chunk_frames, layout.count)
+            tasks.append((index, layout, start, stop))
+            index += stop - start
+
+    with concurrent.futures.ProcessPoolExecutor(processes) as pool:
+        futures = [(index, stop - start,
+                    pool.submit(decode_chunk, layout, start, stop, convert))
+                   for index, layout, start, stop in tasks]
+
+        for index, count, future in futures:
+            result[index:index + count] = future.result()
+
+    return(result)
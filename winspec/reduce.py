@@ -0,0 +1,207 @@
+# 
+# Copyright (c) 2011-2014, Thomas Bischof
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without 
+# modification, are permitted provided that the following conditions are met:
+# 
+# 1. Redistributions of source code must retain the above copyright notice, 
+#    this list of conditions and the following disclaimer.
+# 
+# 2. Redistributions in binary form must reproduce the above copyright notice, 
+#    this list of conditions and the following disclaimer in the documentation 
+#    and/or other materials provided with the distribution.
+# 
+# 3. Neither the name of the Massachusetts Institute of Technology nor the 
+#    names of its contributors may be used to endorse or promote products 
+#    derived from this software without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" 
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE 
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE 
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE 
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR 
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF 
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS 
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN 
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) 
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE 
+# POSSIBILITY OF SUCH DAMAGE.
+# 
+
+
+"""
+Reductions over the frames of a file (sum, mean, minimum, maximum, variance
+and standard deviation), computed from chunks of frames read one at a time,
+so that memory use is bounded regardless of the number of frames.
+
+    result = reduce_frames(Winspec(filename), ("mean", "max"))
+    spectrum = reduce_frames(reader, ("mean",), y_bin=0)["mean"][0]
+"""
+
+import concurrent.futures
+import collections
+
+import numpy
+
+from .Lightfield import Lightfield
+from .Winspec import Winspec
+
+STATISTICS = ("count", "sum", "mean", "min", "max", "var", "std")
+
+# Bytes of working memory needed per pixel of a chunk: the frames themselves,
+# their conversion to float64, and the squared deviations.
+WORKING_BYTES = 3*numpy.dtype(numpy.float64).itemsize
+
+def frame_shape(source, region=0, block=0):
+    """
+    Return the (height, width) of the frames of a Winspec, a Lightfield (for
+    the given region and data block) or an array of frames.
+    """
+    if isinstance(source, Winspec):
+        return((source.frame_height(), source.frame_width()))
+    elif isinstance(source, Lightfield):
+        return(source.regions(region, block).shape[1:])
+    else:
+        return(numpy.shape(source)[1:])
+
+def frame_chunks(source, chunk_frames, region=0, block=None):
+    """
+    Yield the frames of the source in arrays of at most chunk_frames frames.
+    For a Lightfield, only the given region is read, from every data block
+    or only the given one.
+    """
+    if isinstance(source, Winspec):
+        for start in range(0, source.n_frames(), chunk_frames):
+            yield(source.read_frames(start, start + chunk_frames))
+    elif isinstance(source, Lightfield):
+        if block is None:
+            blocks = range(len(source.data_blocks()))
+        else:
+            blocks = [block]
+
+        for my_block in blocks:
+            frames = source.regions(region, my_block)
+            for start in range(0, len(frames), chunk_frames):
+                yield(numpy.array(frames[start:start + chunk_frames]))
+    else:
+        for start in range(0, len(source), chunk_frames):
+            yield(numpy.asarray(source[start:start + chunk_frames]))
+
+def bin_frames(frames, y_bin=1, x_bin=1):
+    """
+    Sum each frame over blocks of y_bin rows and x_bin columns. A bin of 0
+    sums the whole axis, so y_bin=0 gives the vertically binned spectrum.
+    Rows or columns left over from the last whole bin are dropped.
+    """
+    n_frames, height, width = frames.shape
+    y_bin = y_bin or height
+    x_bin = x_bin or width
+
+    if y_bin == 1 and x_bin == 1:
+        return(frames)
+
+    frames = frames[:, :height // y_bin * y_bin, :width // x_bin * x_bin]
+    return(frames.reshape(n_frames,
+                          height // y_bin, y_bin,
+                          width // x_bin, x_bin).sum(axis=(2, 4),
+                                                     dtype=numpy.float64))
+
+Moments = collections.namedtuple("Moments",
+                                 ["count", "sum", "mean", "m2", "min", "max"])
+
+def chunk_moments(frames, y_bin=1, x_bin=1):
+    """
+    Return the Moments of one chunk of frames.
+    """
+    frames = bin_frames(frames, y_bin, x_bin)
+    values = frames.astype(numpy.float64, copy=False)
+
+    total = values.sum(axis=0)
+    mean = total/len(values)
+    m2 = ((values - mean)**2).sum(axis=0)
+
+    return(Moments(len(values), total, mean, m2,
+                   frames.min(axis=0), frames.max(axis=0)))
+
+def combine(a, b):
+    """
+    Combine the Moments of two sets of frames, using the pairwise update of
+    Chan et al. for the squared deviations.
+    """
+    if a is None:
+        return(b)
+
+    count = a.count + b.count
+    delta = b.mean - a.mean
+    mean = a.mean + delta*(b.count/count)
+    m2 = a.m2 + b.m2 + delta**2*(a.count*b.count/count)
+
+    return(Moments(count, a.sum + b.sum, mean, m2,
+                   numpy.minimum(a.min, b.min),
+                   numpy.maximum(a.max, b.max)))
+
+def reduce_frames(source,
+                  statistics=("mean",),
+                  memory=64 << 20,
+                  y_bin=1,
+                  x_bin=1,
+                  threads=None,
+                  region=0,
+                  block=None):
+    """
+    Return a dictionary of the requested statistics (any of STATISTICS)
+    over the frames of a Winspec, a Lightfield region or an array of frames,
+    after binning each frame (see bin_frames).
+
+    Frames are read in chunks sized so that the chunks being processed use
+    about memory bytes. With threads, the chunks are reduced in a pool of
+    that many threads while the next ones are read; numpy releases the GIL
+    for the arithmetic.
+    """
+    for statistic in statistics:
+        if statistic not in STATISTICS:
+            raise(ValueError("Unknown statistic {0}.".format(statistic)))
+
+    height, width = frame_shape(source, region, block or 0)
+    in_flight = (threads or 0) + 1
+    chunk_frames = max(1, memory // (in_flight*WORKING_BYTES
+                                     * max(height*width, 1)))
+    chunks = frame_chunks(source, chunk_frames, region=region, block=block)
+
+    moments = None
+    if threads:
+        with concurrent.futures.ThreadPoolExecutor(threads) as pool:
+            pending = collections.deque()
+            for chunk in chunks:
+                pending.append(pool.submit(chunk_moments, chunk, y_bin, x_bin))
+                if len(pending) >= threads:
+                    moments = combine(moments, pending.popleft().result())
+
+            while pending:
+                moments = combine(moments, pending.popleft().result())
+    else:
+        for chunk in chunks:
+            moments = combine(moments, chunk_moments(chunk, y_bin, x_bin))
+
+    if moments is None:
+        raise(ValueError("There are no frames to reduce."))
+
+    result = dict()
+    for statistic in statistics:
+        if statistic == "count":
+            result[statistic] = moments.count
+        elif statistic == "sum":
+            result[statistic] = moments.sum
+        elif statistic == "mean":
+            result[statistic] = moments.mean
+        elif statistic == "min":
+            result[statistic] = moments.min
+        elif statistic == "max":
+            result[statistic] = moments.max
+        elif statistic == "var":
+            result[statistic] = moments.m2/moments.count
+        elif statistic == "std":
+            result[statistic] = numpy.sqrt(moments.m2/moments.count)
+
+    return(result)
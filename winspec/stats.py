@@ -0,0 +1,148 @@
+# 
+# Copyright (c) 2011-2014, Thomas Bischof
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without 
+# modification, are permitted provided that the following conditions are met:
+# 
+# 1. Redistributions of source code must retain the above copyright notice, 
+#    this list of conditions and the following disclaimer.
+# 
+# 2. Redistributions in binary form must reproduce the above copyright notice, 
+#    this list of conditions and the following disclaimer in the documentation 
+#    and/or other materials provided with the distribution.
+# 
+# 3. Neither the name of the Massachusetts Institute of Technology nor the 
+#    names of its contributors may be used to endorse or promote products 
+#    derived from this software without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" 
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE 
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE 
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE 
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR 
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF 
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS 
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN 
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) 
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE 
+# POSSIBILITY OF SUCH DAMAGE.
+# 
+
+
+"""
+Counters and timers for the I/O and decoding done by a reader. They are off
+by default; pass stats=True (or a Stats) to a reader to collect them:
+
+    reader = Winspec(filename, stats=True)
+    reader.data()
+    print(reader.stats)
+
+A Stats can also be given a callback, which is called as
+callback(name, seconds, attributes) at the end of each timed operation
+(header, footer, decode), in the manner of a tracing span.
+
+A Stats may be shared by threads reading from the same reader. The counters
+are updated under a lock, and the timers add up the time spent in each
+thread.
+"""
+
+import contextlib
+import threading
+import time
+
+COUNTERS = ("bytes_read", "read_calls", "frames_decoded")
+TIMERS = ("header_time", "footer_time", "decode_time")
+
+class Stats(object):
+    def __init__(self, callback=None):
+        self.callback = callback
+        self._lock = threading.Lock()
+        # The names of the timers running in each thread.
+        self._local = threading.local()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            for name in COUNTERS + TIMERS:
+                setattr(self, name, 0)
+
+    def read(self, n_bytes, calls=1):
+        with self._lock:
+            self.bytes_read += n_bytes
+            self.read_calls += calls
+
+    def decoded(self, n_frames, seconds):
+        with self._lock:
+            self.frames_decoded += n_frames
+            self.decode_time += seconds
+        if self.callback is not None:
+            self.callback("decode", seconds, {"frames": n_frames})
+
+    def decode_time_per_frame(self):
+        if self.frames_decoded:
+            return(self.decode_time/self.frames_decoded)
+        else:
+            return(None)
+
+    @contextlib.contextmanager
+    def timer(self, name, **attributes):
+        """
+        Time the body of the with statement, adding the time to the
+        name_time timer. Only the outermost of nested timers with the same
+        name in a thread is counted, so that the time is not counted twice.
+        """
+        active = getattr(self._local, "active", None)
+        if active is None:
+            active = self._local.active = set()
+        if name in active:
+            yield(self)
+            return
+
+        active.add(name)
+        start = time.perf_counter()
+        try:
+            yield(self)
+        finally:
+            elapsed = time.perf_counter() - start
+            active.discard(name)
+            with self._lock:
+                setattr(self, name + "_time",
+                        getattr(self, name + "_time") + elapsed)
+            if self.callback is not None:
+                self.callback(name, elapsed, attributes)
+
+    def as_dict(self):
+        with self._lock:
+            result = dict((name, getattr(self, name))
+                          for name in COUNTERS + TIMERS)
+        result["decode_time_per_frame"] = None
+        if result["frames_decoded"]:
+            result["decode_time_per_frame"] = result["decode_time"] \
+                                              / result["frames_decoded"]
+        return(result)
+
+    def __repr__(self):
+        return("Stats({0})".format(", ".join(
+            "{0}={1!r}".format(name, value)
+            for name, value in self.as_dict().items())))
+
+def make_stats(stats):
+    """
+    Return the Stats for a reader given its stats argument: None or False
+    to disable them, True for a new Stats, or a Stats to share.
+    """
+    if stats is True:
+        return(Stats())
+    else:
+        return(stats or None)
+
+def timer(stats, name, **attributes):
+    """
+    Return a context manager timing name in stats, or doing nothing if stats
+    is None.
+    """
+    if stats is None:
+        return(contextlib.nullcontext())
+    else:
+        return(stats.timer(name, **attributes))
@@ -0,0 +1,159 @@
+# 
+# Copyright (c) 2011-2014, Thomas Bischof
+# All rights reserved.
+# 
+# Redistribution and use in source and binary forms, with or without 
+# modification, are permitted provided that the following conditions are met:
+# 
+# 1. Redistributions of source code must retain the above copyright notice, 
+#    this list of conditions and the following disclaimer.
+# 
+# 2. Redistributions in binary form must reproduce the above copyright notice, 
+#    this list of conditions and the following disclaimer in the documentation 
+#    and/or other materials provided with the distribution.
+# 
+# 3. Neither the name of the Massachusetts Institute of Technology nor the 
+#    names of its contributors may be used to endorse or promote products 
+#    derived from this software without specific prior written permission.
+# 
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" 
+# AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE 
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE 
+# ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE 
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR 
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF 
+# SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS 
+# INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN 
+# CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) 
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE 
+# POSSIBILITY OF SUCH DAMAGE.
+# 
+
+
+"""
+Write SPE files one frame at a time, for acquisitions which are too long to
+hold in memory.
+
+    with Writer("out.spe", (height, width), numpy.uint16) as writer:
+        for frame in frames:
+            writer.write(frame)
+"""
+
+import numpy
+
+from .Lightfield import DATATYPES, PIXEL_FORMATS, make_footer, pack_header
+from .Winspec import ENDIANNESS, data_header, data_type_index, data_types
+
+def pixel_type(dtype):
+    """
+    Return the struct type used to store an array of the given dtype in a
+    version 3.0 file, one of PIXEL_FORMATS. Other types are converted as for
+    version 2.x files where that is exact; the rest, including signed 32-bit
+    integers, raise ValueError.
+    """
+    dtype = numpy.dtype(dtype)
+    for data_type in PIXEL_FORMATS:
+        if dtype.newbyteorder(ENDIANNESS) == numpy.dtype(
+                "{0}{1}".format(ENDIANNESS, data_type)):
+            return(data_type)
+
+    data_type = data_types[data_type_index(dtype)]
+    if data_type not in PIXEL_FORMATS:
+        raise(ValueError("Version 3.0 files cannot hold {0} data.".format(
+            dtype)))
+
+    return(data_type)
+
+class Writer(object):
+    """
+    Write the header of an SPE file up front and append frames as they
+    arrive. On close, the number of frames in the header is patched in place
+    and, for version 3.0 files, the XML footer is written and its offset
+    recorded in the header. Only the frame being written is held in memory.
+    """
+    def __init__(self, filename, shape, dtype, header=None, version=2):
+        self.filename = filename
+        self.height, self.width = shape
+        self.version = version
+        self.n_frames = 0
+
+        if version >= 3:
+            data_type = pixel_type(dtype)
+            self._datatype = [key for key, value in DATATYPES.items()
+                              if value == data_type
+                              and not isinstance(key, str)][0]
+        else:
+            self._datatype = data_type_index(dtype)
+            data_type = data_types[self._datatype]
+
+        self._dtype = numpy.dtype("{0}{1}".format(ENDIANNESS, data_type))
+        self._frame_bytes = self.height*self.width*self._dtype.itemsize
+
+        self._header = data_header(header,
+                                   0,
+                                   self.height,
+                                   self.width,
+                                   self._datatype)
+        if version >= 3:
+            self._header.file_header_ver = 3.0
+
+        self._stream = open(filename, "wb")
+        self._stream.write(self._header.to_bytes())
+
+    def __enter__(self):
+        return(self)
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def write(self, frames):
+        """
+        Append a frame of shape (height, width), a stack of frames of shape
+        (n_frames, height, width), or a buffer holding whole frames in the
+        file datatype.
+        """
+        if isinstance(frames, numpy.ndarray):
+            if frames.shape[-2:] != (self.height, self.width):
+                raise(ValueError("Expected frames of shape {0}, "
+                                 "got {1}.".format((self.height, self.width),
+                                                   frames.shape[-2:])))
+            data = memoryview(numpy.ascontiguousarray(frames,
+                                                      dtype=self._dtype))
+        else:
+            data = memoryview(frames)
+
+        n_bytes = data.nbytes
+        if n_bytes % self._frame_bytes:
+            raise(ValueError("{0} bytes is not a whole number of "
+                             "{1}-byte frames.".format(n_bytes,
+                                                       self._frame_bytes)))
+
+        self._stream.write(data.cast("B"))
+        self.n_frames += n_bytes // self._frame_bytes
+
+    def close(self):
+        if self._stream.closed:
+            return
+
+        try:
+            self._header.NumFrames = self.n_frames
+            header = bytearray(self._header.to_bytes())
+            footer_offset = self._stream.tell()
+
+            # The header is patched before the footer is written, so that a
+            # reader following the file never mistakes the footer for frames.
+            if self.version >= 3:
+                pack_header(header, xml_footer_offset=footer_offset)
+
+            self._stream.seek(0)
+            self._stream.write(header)
+
+            if self.version >= 3:
+                self._stream.flush()
+                self._stream.seek(footer_offset)
+                self._stream.write(make_footer(self.n_frames,
+                                               self.height,
+                                               self.width,
+                                               self._dtype.char))
+        finally:
+            self._stream.close()